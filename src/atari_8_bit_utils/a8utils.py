@@ -1,17 +1,66 @@
 import os
 import typer
 import logging
+import json
 from .atascii import to_utf8, to_atascii, files_to_utf8, files_to_atascii
-from .sync import sync_main
-from typing import Callable
+from .control import COMMANDS, send_command
+from .basic import basic_to_utf8, is_tokenized
+from .diskimage import ImageError, extract_image, list_image
+from functools import partial
+from typing import TYPE_CHECKING, Callable, List, Optional
 from typing_extensions import Annotated
 from pathlib import Path
 from enum import Enum
 import sys
 
+# Every command pays for the imports of this module on startup, so modules that
+# only some commands need (sqlite3, asyncio, multiprocessing, ...) are imported
+# by those commands.
+if TYPE_CHECKING:
+    from .cache import Cache
+
 logger = logging.getLogger(__name__)
 
 app = typer.Typer()
+cache_app = typer.Typer(help='Inspect or clear the cache of converted files')
+app.add_typer(cache_app, name='cache')
+index_app = typer.Typer(help='Build and search an index of the files on a collection of disk images')
+app.add_typer(index_app, name='index')
+screen_app = typer.Typer(help='Render screen memory dumps (ANTIC internal character codes) as UTF-8 text')
+app.add_typer(screen_app, name='screen')
+
+CacheOption = Annotated[str, typer.Option(envvar='A8UTILS_CACHE', help='Directory of the content addressed cache of converted files')]
+CacheSizeOption = Annotated[int, typer.Option(help='Maximum size of the cache in bytes')]
+IndexOption = Annotated[str, typer.Option(envvar='A8UTILS_INDEX', help='SQLite database of the index')]
+
+
+class Engine(str, Enum):
+    SERIAL = 'serial'
+    ASYNCIO = 'asyncio'
+
+
+class ProfileMode(str, Enum):
+    CPROFILE = 'cprofile'
+    SAMPLE = 'sample'
+
+
+class ArchiveFormat(str, Enum):
+    TAR = 'tar'
+    TGZ = 'tgz'
+    ZIP = 'zip'
+
+
+class ScreenMode(str, Enum):
+    GR0 = 'gr0'
+    ANTIC4 = 'antic4'
+    ANTIC5 = 'antic5'
+    GR1 = 'gr1'
+    GR2 = 'gr2'
+
+
+ModeOption = Annotated[ScreenMode, typer.Option(help='ANTIC text mode, determines the size of a frame and how characters are decoded')]
+ColumnsOption = Annotated[int, typer.Option(help='Characters per row. Defaults to the width of the mode')]
+RowsOption = Annotated[int, typer.Option(help='Rows per frame. Defaults to the height of the mode')]
 
 
 class PathType(Enum):
@@ -21,6 +70,17 @@ class PathType(Enum):
     ERROR = 4
 
 
+@app.callback()
+def main(
+    ctx: typer.Context,
+    profile: Annotated[str, typer.Option(help='Profile the command and write the result to this file. Use "-" for STDERR')] = None,
+    profile_mode: Annotated[ProfileMode, typer.Option(help='cprofile: pstats data of the main thread. sample: folded stack samples of all threads, for flame graphs')] = ProfileMode.CPROFILE
+):
+    if profile:
+        from .profiling import start_profile
+        ctx.call_on_close(start_profile(profile, profile_mode.value))
+
+
 def path_type(path: str, new_ok: bool = False):
     logging.info(f'Path: {path}')
     if (path == '-'):
@@ -65,29 +125,357 @@ def convert(input: str, output: str, file_converter: Callable, dir_converter):
             dir_converter(input, output)
 
 
+def is_basic_file(path: str) -> bool:
+    f = open(path, 'rb')
+    data = f.read()
+    f.close()
+    return is_tokenized(data)
+
+
+def log_cache(cache: Optional['Cache']):
+    if cache:
+        logger.info(f'Cache: {cache.hits} hits, {cache.misses} misses')
+
+
+PathsArgument = Annotated[Optional[List[str]], typer.Argument(
+    help='INPUT [OUTPUT]. Use "-" for STDIN/STDOUT. More than two paths are converted as INPUT OUTPUT pairs, '
+         'or as inputs only when --output-dir is given', show_default=False)]
+OutputDirOption = Annotated[str, typer.Option(help='Batch mode: write each input to the same relative path in this directory')]
+ManifestOption = Annotated[str, typer.Option(help='Batch mode: file with one INPUT<TAB>OUTPUT pair (or only INPUT, with --output-dir) per line')]
+NullOption = Annotated[bool, typer.Option('--null', '-0', help='Batch mode: read NUL separated input paths from STDIN, e.g. from find -print0')]
+JobsOption = Annotated[int, typer.Option(help='Batch mode: number of worker processes. Defaults to the number of CPUs')]
+
+
+def batch_pairs(paths: List[str], output_dir: str, manifest: str, null: bool) -> Optional[List]:
+    '''
+    Returns the input/output pairs to convert in batch mode, or None when the
+    arguments describe a single conversion
+    '''
+    if not (output_dir or manifest or null or len(paths) > 2):
+        return None
+
+    from .batch import output_path, read_null_separated
+    pairs = []
+    try:
+        if manifest:
+            pairs += manifest_pairs(manifest, output_dir)
+        if null:
+            pairs += read_null_separated(sys.stdin.buffer, output_dir)
+        if output_dir:
+            pairs += [(path, output_path(path, output_dir)) for path in paths]
+    except ValueError as e:
+        raise typer.BadParameter(str(e), param_hint='--output-dir')
+
+    if not output_dir:
+        if len(paths) % 2:
+            raise typer.BadParameter('Without --output-dir, paths must be given as INPUT OUTPUT pairs', param_hint='[PATHS]')
+        pairs += list(zip(paths[::2], paths[1::2]))
+    return pairs
+
+
+def manifest_pairs(manifest: str, output_dir: Optional[str]) -> List:
+    from .batch import read_manifest
+    try:
+        return read_manifest(manifest, output_dir)
+    except (OSError, UnicodeDecodeError) as e:
+        raise typer.BadParameter(f'Could not read {manifest}: {e}', param_hint='--manifest')
+
+
+def batch(pairs: List, direction: str, jobs: int, cache: str, cache_size: int, detokenize: bool = False):
+    from .batch import run_batch
+    failed = 0
+    for input, output, error in run_batch(pairs, direction, jobs, cache, cache_size, detokenize):
+        if error:
+            failed += 1
+            print(f'FAILED {input} -> {output}: {error}', file=sys.stderr)
+        else:
+            logger.info(f'OK {input} -> {output}')
+
+    print(f'Converted {len(pairs) - failed} of {len(pairs)}, {failed} failed', file=sys.stderr)
+    if failed:
+        raise typer.Exit(1)
+
+
+def check_paths(paths: List[str], manifest: str, null: bool) -> List[str]:
+    '''
+    In check mode nothing is written, so every path is an input
+    '''
+    inputs = list(paths)
+    # The outputs are ignored, the directory only keeps inputs without an output valid
+    if manifest:
+        inputs += [input for input, _ in manifest_pairs(manifest, os.curdir)]
+    if null:
+        from .batch import read_null_separated
+        inputs += [input for input, _ in read_null_separated(sys.stdin.buffer, os.curdir)]
+    return inputs or ['-']
+
+
+def check_inputs(inputs: List[str], jobs: int):
+    from .validate import check_files
+    problems = 0
+    files = set()
+    for path, line, column, message in check_files(inputs, jobs):
+        problems += 1
+        files.add(path)
+        print(f'{path}:{line}:{column}: {message}')
+
+    print(f'{problems} problems in {len(files)} files', file=sys.stderr)
+    if problems:
+        raise typer.Exit(1)
+
+
 @app.command(help="Converts STDIN, a single file, or all files in a directory from ATASCII to UTF-8")
 def ata2utf(
-    input: Annotated[str, typer.Argument(help='Input file or directory. Use "-" for STDIN', )] = '-',
-    output: Annotated[str, typer.Argument(help='Output file or directory. Use "-" for STDOUT')] = '-'
+    paths: PathsArgument = None,
+    cache: CacheOption = None,
+    cache_size: CacheSizeOption = None,
+    detokenize: Annotated[bool, typer.Option(help='Write tokenized BASIC programs as listings. In a directory, NAME.BAS becomes NAME.BAS.LST')] = False,
+    output_dir: OutputDirOption = None,
+    manifest: ManifestOption = None,
+    null: NullOption = False,
+    jobs: JobsOption = None
 ):
-    convert(input, output, to_utf8, files_to_utf8)
+    paths = paths or []
+    pairs = batch_pairs(paths, output_dir, manifest, null)
+    if pairs is not None:
+        return batch(pairs, 'utf8', jobs, cache, cache_size, detokenize)
+
+    input = paths[0] if paths else '-'
+    output = paths[1] if len(paths) > 1 else '-'
+    if cache:
+        from .cache import open_cache
+        cache = open_cache(cache, cache_size)
+    file_converter = cache.converter('utf8', to_utf8) if cache else to_utf8
+    if detokenize and path_type(input) == PathType.FILE and is_basic_file(input):
+        file_converter = cache.converter('basic', basic_to_utf8) if cache else basic_to_utf8
+    convert(input, output, file_converter, partial(files_to_utf8, cache=cache, detokenize=detokenize))
+    log_cache(cache)
 
 
 @app.command(help="Converts STDIN, a single file, all files in a directory from UTF-8 to ATASCII")
 def utf2ata(
-    input: Annotated[str, typer.Argument(help='Input file or directory. Use "-" for STDIN')] = '-',
-    output: Annotated[str, typer.Argument(help='Output file or directory. Use "-" for STDOUT')] = '-'
+    paths: PathsArgument = None,
+    cache: CacheOption = None,
+    cache_size: CacheSizeOption = None,
+    output_dir: OutputDirOption = None,
+    manifest: ManifestOption = None,
+    null: NullOption = False,
+    jobs: JobsOption = None,
+    check: Annotated[bool, typer.Option(help='Only check that the inputs can be converted, without writing any output. Reports every character that has no ATASCII representation')] = False
 ):
-    convert(input, output, to_atascii, files_to_atascii)
+    paths = paths or []
+    if check:
+        return check_inputs(check_paths(paths, manifest, null), jobs)
+    pairs = batch_pairs(paths, output_dir, manifest, null)
+    if pairs is not None:
+        return batch(pairs, 'atascii', jobs, cache, cache_size)
+
+    input = paths[0] if paths else '-'
+    output = paths[1] if len(paths) > 1 else '-'
+    if cache:
+        from .cache import open_cache
+        cache = open_cache(cache, cache_size)
+    file_converter = cache.converter('atascii', to_atascii) if cache else to_atascii
+    convert(input, output, file_converter, partial(files_to_atascii, cache=cache))
+    log_cache(cache)
 
 
 @app.command(help='Keeps an ATR image and and a local directory in sync. Optionally manages a git repo in the directory')
 def atr2git(
     reset_config: Annotated[bool, typer.Option(help='Overwrite existing state.json with default values')] = False,
     once: Annotated[bool, typer.Option(help='Synchronize only once and exit when there is nothing to do.')] = None,
-    daemon: Annotated[bool, typer.Option(help='Run forever in a loop. Overrides config.daemon in state.json')] = None
+    daemon: Annotated[bool, typer.Option(help='Run forever in a loop. Overrides config.daemon in state.json')] = None,
+    control_port: Annotated[int, typer.Option(help='Listen for control commands on 127.0.0.1:PORT. Overrides config.control_port in state.json')] = None,
+    project: Annotated[Optional[List[str]], typer.Option(help='Project root to supervise. Can be repeated. Every ATR image in PROJECT/atr is synced')] = None,
+    manifest: Annotated[str, typer.Option(help='JSON file listing the projects and images to supervise')] = None,
+    jobs: Annotated[int, typer.Option(help='Number of projects that can be synced concurrently when supervising')] = None,
+    engine: Annotated[Engine, typer.Option(help='Engine that drives the sync logic. asyncio overlaps scanning, extraction and commits')] = Engine.SERIAL,
+    cache: Annotated[str, typer.Option(envvar='A8UTILS_CACHE', help='Directory of the cache of converted files. Overrides config.cache_dir in state.json')] = None,
+    metrics_file: Annotated[str, typer.Option(help='Periodically write sync metrics to this Prometheus textfile. Overrides config.metrics_file in state.json')] = None,
+    status_file: Annotated[str, typer.Option(help='Periodically write sync metrics and status to this JSON file. Overrides config.status_file in state.json')] = None
+):
+    overrides = {}
+    if cache:
+        overrides['cache_dir'] = cache
+
+    if project or manifest:
+        from .supervisor import supervise_main
+        supervise_main(project, manifest, reset_config, once, daemon, control_port, jobs, engine.value, overrides,
+                       metrics_file, status_file)
+    else:
+        from .sync import sync_main
+        sync_main(reset_config, once, daemon, control_port, engine.value, overrides, metrics_file, status_file)
+
+
+@app.command(help=f'Sends a command to a running atr2git process. COMMAND is one of {", ".join(COMMANDS)}')
+def ctl(
+    command: Annotated[str, typer.Argument(help='The command to send')],
+    port: Annotated[int, typer.Option(help='Port of the atr2git control channel')]
+):
+    if command not in COMMANDS:
+        raise typer.BadParameter(f'"{command}" is not one of {", ".join(COMMANDS)}', param_hint='[COMMAND]')
+    try:
+        response = send_command(command, port)
+    except OSError as e:
+        print(f'Could not reach atr2git on port {port}: {e}', file=sys.stderr)
+        raise typer.Exit(1)
+    print(json.dumps(response, indent=4))
+    if not response.get('ok'):
+        raise typer.Exit(1)
+
+
+@app.command(help='Extracts all files from an ATR, XFD, DCM or ATX disk image with an Atari DOS 2 compatible file system')
+def extract(
+    image: Annotated[str, typer.Argument(help='The disk image')],
+    output: Annotated[str, typer.Argument(help='Directory to write the files to')] = None,
+    list_only: Annotated[bool, typer.Option('--list', '-l', help='Only list the files on the image')] = False
+):
+    try:
+        if list_only or not output:
+            for entry in list_image(image):
+                name = os.path.join(entry.path, entry.filename) + ('/' if entry.is_dir else '')
+                print(f'{name:<28} {entry.count:>5} sectors')
+            return
+        for path in extract_image(image, output):
+            logger.info(f'Extracted {path}')
+    except (OSError, ImageError) as e:
+        print(f'Could not read {image}: {e}', file=sys.stderr)
+        raise typer.Exit(1)
+
+
+@app.command(help='Writes the files of one or more disk images to a tar or zip archive, both as ATASCII and as UTF-8')
+def archive(
+    images: Annotated[List[str], typer.Argument(help='Disk images, or directories of disk images')],
+    output: Annotated[str, typer.Option('--output', '-o', help='Archive to write. Writes to STDOUT if not given')] = None,
+    format: Annotated[Optional[ArchiveFormat], typer.Option(help='Archive format. Defaults to the extension of --output, or tar')] = None,
+    detokenize: Annotated[bool, typer.Option(help='Write tokenized BASIC programs as listings to NAME.BAS.LST')] = False,
+    jobs: Annotated[int, typer.Option(help='Number of images read concurrently. Defaults to the number of CPUs')] = None
+):
+    from .archive import archive_format, write_archive
+    format = archive_format(output, format.value if format else None)
+    stream = open(output, 'wb') if output else sys.stdout.buffer
+    total = failed = 0
+    try:
+        # The archive may be written to STDOUT, so all progress goes to STDERR
+        for path, count, error in write_archive(images, stream, format, jobs, detokenize):
+            total += 1
+            if error:
+                failed += 1
+                print(f'FAILED {path}: {error}', file=sys.stderr)
+            else:
+                print(f'OK {path}: {count} files', file=sys.stderr)
+    finally:
+        if output:
+            stream.close()
+
+    print(f'Archived {total - failed} of {total} images, {failed} failed', file=sys.stderr)
+    if failed:
+        raise typer.Exit(1)
+
+
+@cache_app.command('stats', help='Shows the size of the cache and its hit and miss counters')
+def cache_stats(cache: CacheOption):
+    from .cache import open_cache
+    print(json.dumps(open_cache(cache).stats(), indent=4))
+
+
+@cache_app.command('clear', help='Removes all entries from the cache')
+def cache_clear(cache: CacheOption):
+    from .cache import open_cache
+    open_cache(cache).clear()
+
+
+@index_app.command('update', help='Adds the disk images in ROOTS to the index. Only new and changed images are read')
+def index_update(
+    roots: Annotated[List[str], typer.Argument(help='Disk images, or directories that are searched recursively')],
+    db: IndexOption = 'index.sqlite',
+    jobs: Annotated[int, typer.Option(help='Number of images read concurrently. Defaults to the number of CPUs')] = None,
+    prune: Annotated[bool, typer.Option(help='Remove images below ROOTS that no longer exist')] = True
+):
+    from .index import Index
+    index = Index(db)
+    print(json.dumps(index.update(roots, jobs, prune), indent=4))
+    index.close()
+
+
+@index_app.command('search', help='Finds files by name, checksum and/or content')
+def index_search(
+    db: IndexOption = 'index.sqlite',
+    name: Annotated[str, typer.Option(help='File name, * and ? are wildcards. Case insensitive')] = None,
+    checksum: Annotated[str, typer.Option('--hash', help='MD5 checksum of the ATASCII file, or a prefix of it')] = None,
+    text: Annotated[str, typer.Option(help='Substring of the UTF-8 conversion of the file. Case insensitive')] = None,
+    limit: Annotated[int, typer.Option(help='Maximum number of results')] = 1000,
+    as_json: Annotated[bool, typer.Option('--json', help='Print the results as JSON')] = False
+):
+    from .index import Index
+    index = Index(db)
+    results = index.search(name, checksum, text, limit)
+    index.close()
+    if as_json:
+        print(json.dumps(results, indent=4))
+        return
+    for result in results:
+        print(f'{result["image"]}\t{result["path"]}\t{result["size"]}\t{result["checksum"]}\t{result["sectors"]}')
+
+
+@index_app.command('stats', help='Shows the number of images and files in the index')
+def index_stats(db: IndexOption = 'index.sqlite'):
+    from .index import Index
+    index = Index(db)
+    print(json.dumps(index.stats(), indent=4))
+    index.close()
+
+
+@screen_app.command('render', help='Renders every frame in one or more capture files')
+def screen_render(
+    captures: Annotated[List[str], typer.Argument(help='Files of consecutive frames, or directories of them')],
+    mode: ModeOption = ScreenMode.GR0,
+    columns: ColumnsOption = None,
+    rows: RowsOption = None,
+    ansi: Annotated[bool, typer.Option(help='Show inverse characters in reverse video instead of escaping them with "`"')] = False
+):
+    from .screen import Renderer, frame_files, render_file
+    for path in frame_files(captures):
+        for i, frame in enumerate(render_file(path, Renderer(mode.value, columns, rows, ansi))):
+            print(f'--- {path}#{i}')
+            print(frame, end='')
+
+
+@screen_app.command('watch', help='Shows a live stream of frames, e.g. from an emulator writing to a named pipe')
+def screen_watch(
+    source: Annotated[str, typer.Argument(help='File or named pipe to read frames from. Use "-" for STDIN')] = '-',
+    mode: ModeOption = ScreenMode.GR0,
+    columns: ColumnsOption = None,
+    rows: RowsOption = None
 ):
-    sync_main(reset_config, once, daemon)
+    from .screen import Renderer, watch
+    f = sys.stdin.buffer if source == '-' else open(source, 'rb', buffering=0)
+    try:
+        watch(f, sys.stdout, Renderer(mode.value, columns, rows, ansi=True))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+
+
+@screen_app.command('diff', help='Compares two captures, or two directories of captures, frame by frame')
+def screen_diff(
+    expected: Annotated[str, typer.Argument(help='Expected capture file or directory')],
+    actual: Annotated[str, typer.Argument(help='Actual capture file or directory')],
+    mode: ModeOption = ScreenMode.GR0,
+    columns: ColumnsOption = None,
+    rows: RowsOption = None
+):
+    from .screen import diff_frames
+    differences = 0
+    for name, frame, diff in diff_frames(expected, actual, mode.value, columns, rows):
+        differences += 1
+        print(diff if frame >= 0 else f'{name}: {diff}', end='')
+
+    print(f'{differences} frames differ', file=sys.stderr)
+    if differences:
+        raise typer.Exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,182 @@
+from __future__ import annotations
+from collections.abc import Callable
+from concurrent.futures import Executor, ThreadPoolExecutor
+import asyncio
+import inspect
+import threading
+import time
+from .atascii import clear_dir, files_to_utf8
+from .behavior import Result
+from .diskimage import ImageError, extract_image, is_atr
+from .metrics import metrics
+from .sync import Project, controller, git_lock, record_tick, state_keys
+
+# Hashing and conversion for every AsyncProject in the process run on one pool.
+# It is separate from the Supervisor's tick pool, since ticks wait on it.
+executor: ThreadPoolExecutor | None = None
+executor_lock = threading.Lock()
+
+# Event loop of each Supervisor worker thread, reused for every tick it runs
+loops = threading.local()
+
+
+def shared_executor() -> ThreadPoolExecutor:
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(thread_name_prefix='a8utils-io')
+        return executor
+
+
+class AsyncProject(Project):
+    '''
+    Project whose behavior tree is driven by asyncio. lsatr and git are run with
+    asyncio.create_subprocess_exec, and hashing and conversion are pushed to an
+    executor, so that independent stages can overlap. The tree itself is still
+    walked in order, so an action only starts once the one before it is done.
+    '''
+
+    # State keys whose source isn't modified by the action that updates them. For
+    # these, the new state is computed while the action runs, e.g. the ATR image is
+    # hashed while lsatr is reading it.
+    independent_keys = {'atr', 'atascii', 'commit'}
+
+    def __init__(self, *args, executor: Executor | None = None, **kwds) -> None:
+        super().__init__(*args, **kwds)
+        # If None, the event loop's default executor is used
+        self.executor = executor
+
+    async def run_in_executor(self, func: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def run_process(self, *args: str) -> int:
+        process = await asyncio.create_subprocess_exec(*args)
+        return await process.wait()
+
+    async def get_current_state_async(self):
+        with metrics.timer('scan', project=self.name):
+            values = await asyncio.gather(*[self.run_in_executor(self.get_state, key) for key in state_keys])
+        state = dict(zip(state_keys, values))
+
+        # COMMIT MSG
+        if state['commit'] is None:
+            del state['commit']
+
+        return state
+
+    def update(self, key: str, action: Callable) -> Callable:
+        async def run():
+            if key in self.independent_keys:
+                result, value = await asyncio.gather(self.await_result(action), self.run_in_executor(self.get_state, key))
+            else:
+                result = await self.await_result(action)
+                value = None if result != Result.SUCCESS else await self.run_in_executor(self.get_state, key)
+
+            if result != Result.SUCCESS:
+                self.log(f'\nSkipping state up since step returned {result}')
+                return result
+
+            stored_state = await self.run_in_executor(self.load_state)
+            self.log(f'\tUpdating state[{key}]')
+            stored_state[key] = value
+            await self.run_in_executor(self.save_state, stored_state)
+            return Result.SUCCESS
+
+        return run
+
+    async def await_result(self, action: Callable) -> Result:
+        result = action()
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def wait(self):
+        if self.supervised:
+            return super().wait()
+
+        delay = self.get_config('delay')
+        print(f'Sleeping for {delay} seconds')
+        if await controller.sleep_async(delay):
+            print('\tWoken up by control channel')
+        return Result.SUCCESS
+
+    async def extract_atr(self):
+        with metrics.timer('extract', project=self.name):
+            await self.run_in_executor(clear_dir, self.atascii_dir)
+            atr_file = self.current_state['atr'][0].name
+            if is_atr(atr_file):
+                await self.run_process('lsatr', '-X', self.atascii_dir, self.atr_path(atr_file))
+            else:
+                try:
+                    await self.run_in_executor(extract_image, self.atr_path(atr_file), self.atascii_dir)
+                except ImageError as e:
+                    return self.fail(f'\tCould not read {atr_file}: {e}')
+        return Result.SUCCESS
+
+    async def delete_utf8(self):
+        return await self.run_in_executor(Project.delete_utf8, self)
+
+    async def write_utf8(self):
+        cache = self.get_cache()
+        pending = self.pending_utf8() if self.current_state['utf8'] else None
+        start = time.perf_counter()
+        with metrics.timer('convert', project=self.name):
+            await self.run_in_executor(files_to_utf8, self.atascii_dir, self.utf8_dir, False, cache,
+                                       bool(self.get_config('detokenize')), pending)
+        self.record_conversion(time.perf_counter() - start, pending)
+        self.log_cache(cache)
+        return Result.SUCCESS
+
+    async def commit(self):
+        root, utf8, atascii, msg = self.commit_paths()
+        # Supervised projects each run their own event loop, so wait for the
+        # repository on a thread rather than blocking this one
+        lock = git_lock(root)
+        await self.run_in_executor(lock.acquire)
+        try:
+            with metrics.timer('git', project=self.name):
+                # git takes a lock on the index, so these can't run concurrently
+                await self.run_process('git', '-C', root, 'add', utf8, atascii)
+                await self.run_process('git', '-C', root, 'commit', '-F', msg, '--', utf8, atascii)
+        finally:
+            lock.release()
+        return Result.SUCCESS
+
+    async def tick_async(self) -> Result:
+        '''
+        Runs a single iteration of the reconciliation logic
+        '''
+        self.stored_state, self.current_state = await asyncio.gather(
+            self.run_in_executor(self.load_state),
+            self.get_current_state_async()
+        )
+        self.log_iteration()
+        return await self.tree.tick_async()
+
+    def tick(self) -> Result:
+        # Used by the Supervisor, which runs every tick on its own worker thread
+        loop = getattr(loops, 'loop', None)
+        if loop is None:
+            loop = loops.loop = asyncio.new_event_loop()
+        return loop.run_until_complete(self.tick_async())
+
+
+async def recon_loop_async(project: AsyncProject):
+    while True:
+        await controller.wait_if_paused_async()
+        if controller.shutdown_requested:
+            project.context['exit_now'] = True
+        controller.state = 'running'
+        started = time.time()
+        start = time.perf_counter()
+        await project.tick_async()
+        record_tick(project, started, time.perf_counter() - start)
+
+
+def recon_loop(project: AsyncProject):
+    while True:
+        try:
+            asyncio.run(recon_loop_async(project))
+        except KeyboardInterrupt:
+            project.context['iterations'] += 1
+            project.context['exit_now'] = True
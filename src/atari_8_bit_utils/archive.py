@@ -0,0 +1,181 @@
+from __future__ import annotations
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+import io
+import os
+import re
+import tarfile
+import time
+import zipfile
+from .atascii import bytes_to_utf8
+from .basic import detokenize, is_tokenized
+from .diskimage import Disk, Dos2, ImageError, image_pattern, is_safe_name
+
+# Writes the files of one or more disk images to a tar or zip archive, with the
+# raw ATASCII and the converted UTF-8 version of every file. Images are read and
+# converted in memory by worker processes, and written to the archive in order.
+#
+# The archive has the same layout as an atr2git project, per image:
+#     STEM/atascii/NAME
+#     STEM/utf8/NAME
+# Images with the same stem keep their extension in STEM, e.g. GAME.atr and
+# GAME.dcm, and a number is added if even their file names are the same.
+
+formats = ['tar', 'tgz', 'zip']
+
+# Number of images being read ahead of the one that is written, per worker. Limits
+# memory use when the archive is written slower than the images are read.
+read_ahead = 2
+
+
+def archive_format(output: str | None, format: str | None = None) -> str:
+    if format:
+        return format
+    if output and output.lower().endswith('.zip'):
+        return 'zip'
+    if output and output.lower().endswith(('.tgz', '.tar.gz')):
+        return 'tgz'
+    return 'tar'
+
+
+def image_files(paths: Iterable[str]) -> Iterator[str]:
+    '''
+    Expands directories to the disk images in them
+    '''
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if re.search(image_pattern, name, re.IGNORECASE) and os.path.isfile(os.path.join(path, name)):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def image_stems(paths: list[str]) -> list[str]:
+    '''
+    Unique archive directory of each image
+    '''
+    names = [os.path.basename(path) for path in paths]
+    counts = Counter(os.path.splitext(name)[0] for name in names)
+    stems = []
+    seen = set()
+    for name in names:
+        stem = os.path.splitext(name)[0]
+        key = name if counts[stem] > 1 else stem
+        unique, n = key, 2
+        while unique in seen:
+            unique = f'{key}-{n}'
+            n += 1
+        seen.add(unique)
+        stems.append(unique)
+    return stems
+
+
+def to_listing(data: bytes) -> str:
+    return ''.join([bytes_to_utf8(line) for line in detokenize(data)])
+
+
+def read_image(path: str, detokenize: bool = False, stem: str | None = None) -> tuple[str, list[tuple[str, bytes]], str | None]:
+    '''
+    Returns the image path, the archive members of an image and an error message,
+    or None on success
+    '''
+    stem = stem or os.path.splitext(os.path.basename(path))[0]
+    members = []
+    try:
+        fs = Dos2(Disk.open(path))
+        for entry in fs.walk():
+            # Same check as Dos2.extract, so that member names can't escape STEM
+            if not is_safe_name(entry.filename):
+                raise ImageError(f'Refusing to archive {os.path.join(entry.path, entry.filename)!r}')
+            if entry.is_dir:
+                continue
+            name = '/'.join(entry.path.split(os.sep) + [entry.filename]) if entry.path else entry.filename
+            raw = b''.join(fs.read(entry))
+            members.append((f'{stem}/atascii/{name}', raw))
+            if detokenize and name.upper().endswith('.BAS') and is_tokenized(raw):
+                try:
+                    members.append((f'{stem}/utf8/{name}.LST', to_listing(raw).encode('utf-8')))
+                    continue
+                except Exception:
+                    # A program that can't be listed is archived like any other file,
+                    # rather than failing the whole image
+                    pass
+            members.append((f'{stem}/utf8/{name}', bytes_to_utf8(raw).encode('utf-8')))
+    except Exception as e:
+        return path, [], f'{type(e).__name__}: {e}'
+    return path, members, None
+
+
+class Writer:
+    '''
+    Adds members to a tar or zip archive written to a stream. Both are written
+    sequentially, so the stream doesn't have to be seekable.
+    '''
+
+    def __init__(self, stream, format: str) -> None:
+        self.format = format
+        if format == 'zip':
+            self.archive = zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_DEFLATED)
+        else:
+            self.archive = tarfile.open(fileobj=stream, mode='w|gz' if format == 'tgz' else 'w|')
+
+    def add(self, name: str, data: bytes, mtime: float):
+        if self.format == 'zip':
+            info = zipfile.ZipInfo(name, time.localtime(max(mtime, 315532800))[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            self.archive.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(mtime)
+            self.archive.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self.archive.close()
+
+
+def read_images(paths: list[str], jobs: int | None, detokenize: bool) -> Iterator[tuple[str, list, str | None]]:
+    '''
+    Reads the images in parallel and yields them in order
+    '''
+    reader = partial(read_image, detokenize=detokenize)
+    stems = image_stems(paths)
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(paths) <= 1:
+        for path, stem in zip(paths, stems):
+            yield reader(path, stem=stem)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(paths))) as executor:
+        pending: list[Future] = []
+        remaining = zip(paths, stems)
+        for path, stem in remaining:
+            pending.append(executor.submit(reader, path, stem=stem))
+            if len(pending) >= jobs * read_ahead:
+                break
+        while pending:
+            yield pending.pop(0).result()
+            path, stem = next(remaining, (None, None))
+            if path is not None:
+                pending.append(executor.submit(reader, path, stem=stem))
+
+
+def write_archive(paths: Iterable[str], stream, format: str = 'tar', jobs: int | None = None,
+                  detokenize: bool = False) -> Iterator[tuple[str, int, str | None]]:
+    '''
+    Writes all images to an archive on stream. Yields the path, the number of files
+    and an error message, or None, for each image.
+    '''
+    writer = Writer(stream, format)
+    try:
+        for path, members, error in read_images(list(image_files(paths)), jobs, detokenize):
+            if not error:
+                mtime = os.path.getmtime(path)
+                for name, data in members:
+                    writer.add(name, data, mtime)
+            yield path, len(members) // 2, error
+    finally:
+        writer.close()
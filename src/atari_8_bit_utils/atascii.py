@@ -1,7 +1,10 @@
 from __future__ import annotations
 import os
 import sys
-from typing import Callable
+from typing import TYPE_CHECKING, Callable, Iterable
+
+if TYPE_CHECKING:
+    from .cache import Cache
 
 # Initialize ATASCII to UTF-8 mapping
 
@@ -122,6 +125,13 @@ def to_utf8(in_filename='-', out_filename='-'):
     ifile.close()
 
 
+def bytes_to_utf8(data: bytes) -> str:
+    '''
+    Converts ATASCII data in memory, the same way to_utf8 converts a file
+    '''
+    return ''.join([translate[c] for c in data])
+
+
 def apply_to_dirs(ipath: str, opath: str, applier: Callable[[str, str], None]):
     # Switch to fully qualified paths
     ipath = os.path.abspath(ipath)
@@ -144,15 +154,30 @@ def apply_to_dirs(ipath: str, opath: str, applier: Callable[[str, str], None]):
                 applier(in_filename, out_filename)
 
 
-def files_to_utf8(ipath, opath, clobber=False):
+def files_to_utf8(ipath, opath, clobber=False, cache: Cache | None = None, detokenize: bool = False,
+                  names: Iterable[str] | None = None):
     """
     Recursively converts all files in directory ipath from ATASCII to UTF-8 
-    and writes the output to opath
+    and writes the output to opath. If a cache is given, previously converted
+    files are taken from the cache. If detokenize is set, tokenized BASIC
+    programs are written as listings to NAME.BAS.LST. If names is given, only
+    those files in the top level of ipath are converted.
     """
     if clobber:
         clear_dir(opath)
 
-    apply_to_dirs(ipath, opath, to_utf8)
+    converter = cache.converter('utf8', to_utf8) if cache else to_utf8
+    if detokenize:
+        from .basic import detokenizing
+        converter = detokenizing(converter, cache)
+
+    if names is not None:
+        for name in names:
+            converter(os.path.join(ipath, name), os.path.join(opath, name))
+    else:
+        apply_to_dirs(ipath, opath, converter)
+    if cache:
+        cache.flush()
 
 
 # Converts a single file from UTF-8 to ATASCII
@@ -180,14 +205,17 @@ def to_atascii(in_filename='-', out_filename='-'):
     ofile.close()
 
 
-def files_to_atascii(ipath: str, opath: str, clobber: bool = False):
+def files_to_atascii(ipath: str, opath: str, clobber: bool = False, cache: Cache | None = None):
     """
     Recursively converts all files in directory ipath from UTF-8 to ATASCII
-    and writes the output to opath
+    and writes the output to opath. If a cache is given, previously converted
+    files are taken from the cache.
     """
     if clobber:
         clear_dir(opath)
-    apply_to_dirs(ipath, opath, to_atascii)
+    apply_to_dirs(ipath, opath, cache.converter('atascii', to_atascii) if cache else to_atascii)
+    if cache:
+        cache.flush()
 
 
 def clear_dir(path):
@@ -0,0 +1,267 @@
+from __future__ import annotations
+from collections.abc import Callable, Iterator
+import os
+import struct
+import sys
+from typing import TYPE_CHECKING
+from .atascii import translate
+
+if TYPE_CHECKING:
+    from .cache import Cache
+
+# Detokenizer for programs SAVEd by Atari BASIC. The output is the same ATASCII
+# text that LIST would produce, mapped to UTF-8 with the normal ATASCII mapping.
+
+# Statement tokens, indexed by token value. Token 0x36 is the implied LET, which
+# isn't listed.
+statements = [
+    'REM', 'DATA', 'INPUT', 'COLOR', 'LIST', 'ENTER', 'LET', 'IF', 'FOR', 'NEXT',
+    'GOTO', 'GO TO', 'GOSUB', 'TRAP', 'BYE', 'CONT', 'COM', 'CLOSE', 'CLR', 'DEG',
+    'DIM', 'END', 'NEW', 'OPEN', 'LOAD', 'SAVE', 'STATUS', 'NOTE', 'POINT', 'XIO',
+    'ON', 'POKE', 'PRINT', 'RAD', 'READ', 'RESTORE', 'RETURN', 'RUN', 'STOP', 'POP',
+    '?', 'GET', 'PUT', 'GRAPHICS', 'PLOT', 'POSITION', 'DOS', 'DRAWTO', 'SETCOLOR', 'LOCATE',
+    'SOUND', 'LPRINT', 'CSAVE', 'CLOAD', '', 'ERROR-'
+]
+
+# Operator and function tokens, starting at 0x10. Array and DIM parentheses are
+# empty, since the '(' is part of the variable name.
+operators = [
+    '', '', ',', '$', ':', ';', '', ' GOTO ', ' GOSUB ', ' TO ',
+    ' STEP ', ' THEN ', '#', '<=', '<>', '>=', '<', '>', '=', '^',
+    '*', '+', '-', '/', ' NOT ', ' OR ', ' AND ', '(', ')', '=',
+    '=', '<=', '<>', '>=', '<', '>', '=', '+', '-', '(',
+    '', '', '(', '(', ',', 'STR$', 'CHR$', 'USR', 'ASC', 'VAL',
+    'LEN', 'ADR', 'ATN', 'COS', 'PEEK', 'SIN', 'RND', 'FRE', 'EXP', 'LOG',
+    'CLOG', 'SQR', 'SGN', 'ABS', 'INT', 'PADDLE', 'STICK', 'PTRIG', 'STRIG'
+]
+
+TOKEN_REM = 0x00
+TOKEN_DATA = 0x01
+TOKEN_ERROR = 0x37
+TOKEN_NUMBER = 0x0e
+TOKEN_STRING = 0x0f
+TOKEN_EOS = 0x14
+TOKEN_EOL = 0x16
+
+EOL = 0x9b
+HEADER_SIZE = 14
+
+# Pre-encoded token text, so that the detokenizer only has to concatenate bytes
+statement_bytes = [(s + ' ').encode('ascii') if s else b'' for s in statements]
+operator_bytes = [b''] * 0x10 + [s.encode('ascii') for s in operators]
+
+
+class BasicError(Exception):
+    pass
+
+
+class Program:
+    '''
+    The parsed header and variable name table of a SAVEd Atari BASIC program
+    '''
+
+    def __init__(self, data: bytes) -> None:
+        if len(data) < HEADER_SIZE:
+            raise BasicError('File too short for an Atari BASIC header')
+
+        lomem, vntp, vntd, vvtp, stmtab, stmcur, starp = struct.unpack('<7H', data[:HEADER_SIZE])
+        if lomem != 0 or not (vntp <= vntd < vvtp <= stmtab <= stmcur < starp):
+            raise BasicError('Not a tokenized Atari BASIC program')
+        if HEADER_SIZE + starp - vntp > len(data):
+            raise BasicError('Program is truncated')
+
+        self.data = data
+        # Converts memory addresses to offsets in the file
+        self.offset = HEADER_SIZE - vntp
+        self.stmtab = stmtab + self.offset
+        self.stmcur = stmcur + self.offset
+        self.variables = self.read_variables(vntp + self.offset, vntd + self.offset)
+
+    def read_variables(self, start: int, end: int) -> list[bytes]:
+        variables = []
+        name = bytearray()
+        for byte in self.data[start:end + 1]:
+            if byte == 0:
+                break
+            name.append(byte & 0x7f)
+            if byte & 0x80:
+                variables.append(bytes(name))
+                name = bytearray()
+        return variables
+
+    def variable(self, index: int) -> bytes:
+        if index < len(self.variables):
+            return self.variables[index]
+        # Protected programs often have a scrambled variable table
+        return f'V{index}'.encode('ascii')
+
+    def lines(self) -> Iterator[bytes]:
+        '''
+        Yields every program line as ATASCII text terminated with EOL
+        '''
+        data = self.data
+        pos = self.stmtab
+        while pos + 3 <= self.stmcur:
+            number, length = struct.unpack_from('<HB', data, pos)
+            if number >= 32768 or length < 4:
+                break
+            if pos + length > self.stmcur:
+                raise BasicError(f'Line {number} runs past the end of the program')
+            yield self.line(pos, pos + length, number)
+            pos += length
+
+    def line(self, start: int, end: int, number: int) -> bytes:
+        data = self.data
+        out = bytearray(str(number).encode('ascii'))
+        out += b' '
+        pos = start + 3
+        while pos < end:
+            if pos + 2 > end:
+                raise BasicError(f'Truncated statement in line {number}')
+            next_statement = start + data[pos]
+            token = data[pos + 1]
+            pos += 2
+            if token < len(statement_bytes):
+                out += statement_bytes[token]
+            if token in (TOKEN_REM, TOKEN_DATA, TOKEN_ERROR):
+                # The rest of the statement is stored as text
+                text_end = data.find(EOL, pos, end)
+                out += data[pos:text_end if text_end >= 0 else end]
+                break
+            pos = self.expression(pos, min(next_statement, end), out, number)
+            pos = max(pos, next_statement)
+        out.append(EOL)
+        return bytes(out)
+
+    def expression(self, pos: int, end: int, out: bytearray, number: int) -> int:
+        data = self.data
+        while pos < end:
+            token = data[pos]
+            pos += 1
+            if token >= 0x80:
+                out += self.variable(token - 0x80)
+            elif token == TOKEN_NUMBER:
+                if pos + 6 > end:
+                    raise BasicError(f'Truncated number in line {number}')
+                out += format_number(data[pos:pos + 6])
+                pos += 6
+            elif token == TOKEN_STRING:
+                if pos >= end or pos + 1 + data[pos] > end:
+                    raise BasicError(f'Truncated string in line {number}')
+                length = data[pos]
+                out += b'"' + data[pos + 1:pos + 1 + length] + b'"'
+                pos += 1 + length
+            elif token == TOKEN_EOL:
+                break
+            elif token == TOKEN_EOS:
+                out += b':'
+                break
+            elif token < len(operator_bytes):
+                out += operator_bytes[token]
+        return pos
+
+
+def format_number(bcd: bytes) -> bytes:
+    '''
+    Formats a 6 byte BCD floating point number the way Atari BASIC prints it
+    '''
+    if len(bcd) < 6 or bcd[0] == 0 and not any(bcd[1:]):
+        return b'0'
+
+    sign = '-' if bcd[0] & 0x80 else ''
+    # The exponent is a power of 100, excess 64, with the decimal point after the
+    # first byte of the mantissa
+    exponent = ((bcd[0] & 0x7f) - 64) * 2 + 2
+    digits = ''.join(f'{b >> 4}{b & 0x0f}' for b in bcd[1:6])
+
+    stripped = digits.lstrip('0')
+    exponent -= len(digits) - len(stripped)
+    digits = stripped.rstrip('0') or '0'
+
+    if -2 < exponent <= 10:
+        if exponent <= 0:
+            text = '0.' + '0' * -exponent + digits
+        elif exponent >= len(digits):
+            text = digits + '0' * (exponent - len(digits))
+        else:
+            text = digits[:exponent] + '.' + digits[exponent:]
+    else:
+        mantissa = digits[0] + ('.' + digits[1:] if len(digits) > 1 else '')
+        text = f'{mantissa}E{exponent - 1:+03d}'
+    return (sign + text).encode('ascii')
+
+
+def is_tokenized(data: bytes) -> bool:
+    try:
+        Program(data)
+        return True
+    except BasicError:
+        return False
+
+
+def detokenize(data: bytes) -> Iterator[bytes]:
+    '''
+    Yields the ATASCII listing of a tokenized program, one line at a time
+    '''
+    return Program(data).lines()
+
+
+def basic_to_utf8(in_filename='-', out_filename='-'):
+    '''
+    Converts a tokenized Atari BASIC program to a UTF-8 listing
+    '''
+    if in_filename != '-':
+        f = open(in_filename, 'rb')
+        data = f.read()
+        f.close()
+    else:
+        data = sys.stdin.buffer.read()
+
+    # Detokenize everything first, so that a malformed program doesn't leave a
+    # partial listing behind
+    lines = list(detokenize(data))
+
+    if out_filename != '-':
+        ofile = open(out_filename, 'w', encoding='utf-8')
+    else:
+        ofile = sys.stdout
+
+    for line in lines:
+        ofile.write(''.join([translate[c] for c in line]))
+
+    if ofile is not sys.stdout:
+        ofile.close()
+
+
+def detokenizing(convert: Callable[[str, str], None], cache: Cache | None = None) -> Callable[[str, str], None]:
+    '''
+    Wraps a file converter so that tokenized BASIC programs (*.BAS) are written as
+    a listing to NAME.BAS.LST instead. Other files, and programs that can't be
+    detokenized, are passed on to convert.
+    '''
+    listing = cache.converter('basic', basic_to_utf8) if cache else basic_to_utf8
+
+    def converter(in_filename='-', out_filename='-'):
+        if in_filename != '-' and in_filename.upper().endswith('.BAS'):
+            f = open(in_filename, 'rb')
+            header = f.read(HEADER_SIZE)
+            size = os.fstat(f.fileno()).st_size
+            f.close()
+            if looks_tokenized(header, size):
+                try:
+                    return listing(in_filename, out_filename + '.LST')
+                except BasicError:
+                    pass
+        return convert(in_filename, out_filename)
+
+    return converter
+
+
+def looks_tokenized(header: bytes, size: int) -> bool:
+    '''
+    Cheap check of the header only, so that we don't have to read the whole file
+    '''
+    if len(header) < HEADER_SIZE:
+        return False
+    lomem, vntp, vntd, vvtp, stmtab, stmcur, starp = struct.unpack('<7H', header)
+    return lomem == 0 and vntp <= vntd < vvtp <= stmtab <= stmcur < starp and HEADER_SIZE + starp - vntp <= size
@@ -0,0 +1,135 @@
+from __future__ import annotations
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import os
+import sys
+from .atascii import files_to_atascii, files_to_utf8, to_atascii, to_utf8
+from .basic import basic_to_utf8, is_tokenized
+from .cache import open_cache
+
+# Batch conversion of many input/output pairs in one process. Pairs are handed
+# to a pool of worker processes, since the converters are CPU bound.
+
+# Number of pairs handed to a worker at a time. Batches typically consist of
+# many small files, so sending them one by one would dominate the run time.
+chunksize = 16
+
+
+def read_manifest(path: str, output_dir: str | None = None) -> list[tuple[str, str]]:
+    '''
+    Reads input/output pairs from a manifest file, one pair per line, separated by
+    a tab. Lines with only an input use output_dir. Empty lines and lines starting
+    with '#' are ignored.
+    '''
+    pairs = []
+    f = sys.stdin if path == '-' else open(path, mode='r', encoding='utf-8')
+    for line in f:
+        line = line.rstrip('\r\n')
+        if not line.strip() or line.startswith('#'):
+            continue
+        if '\t' in line:
+            input, output = line.split('\t', 1)
+            pairs.append((input, output))
+        else:
+            pairs.append((line, output_path(line, output_dir)))
+    if f is not sys.stdin:
+        f.close()
+    return pairs
+
+
+def read_null_separated(stream, output_dir: str | None) -> list[tuple[str, str]]:
+    '''
+    Reads NUL separated input paths, as produced by find -print0
+    '''
+    data = stream.read()
+    if isinstance(data, bytes):
+        data = os.fsdecode(data)
+    return [(input, output_path(input, output_dir)) for input in data.split('\0') if input]
+
+
+def output_path(input: str, output_dir: str | None) -> str:
+    '''
+    Maps an input path to the same relative path under output_dir. Paths outside
+    the current directory only keep their file name.
+    '''
+    if not output_dir:
+        raise ValueError(f'No output given for "{input}" and no output directory set')
+    try:
+        relative = os.path.relpath(input)
+    except ValueError:
+        # Input is on a different drive
+        relative = os.path.basename(input)
+    if relative.startswith('..'):
+        relative = os.path.basename(input)
+    return os.path.join(output_dir, relative)
+
+
+def file_converter(direction: str, input: str, cache_dir: str | None, cache_size: int | None,
+                   detokenize: bool = False) -> Callable[[str, str], None]:
+    cache = open_cache(cache_dir, cache_size) if cache_dir else None
+    if direction == 'atascii':
+        return cache.converter('atascii', to_atascii) if cache else to_atascii
+    if detokenize:
+        f = open(input, 'rb')
+        tokenized = is_tokenized(f.read())
+        f.close()
+        if tokenized:
+            return cache.converter('basic', basic_to_utf8) if cache else basic_to_utf8
+    return cache.converter('utf8', to_utf8) if cache else to_utf8
+
+
+def dir_converter(direction: str, cache_dir: str | None, cache_size: int | None,
+                  detokenize: bool = False) -> Callable[[str, str], None]:
+    cache = open_cache(cache_dir, cache_size) if cache_dir else None
+    if direction == 'atascii':
+        return partial(files_to_atascii, cache=cache)
+    return partial(files_to_utf8, cache=cache, detokenize=detokenize)
+
+
+def convert_pair(pair: tuple[str, str], direction: str, cache_dir: str | None = None,
+                 cache_size: int | None = None, detokenize: bool = False) -> tuple[str, str, str | None]:
+    '''
+    Converts a single input file or directory. Returns the input, the output and
+    an error message, or None on success.
+    '''
+    input, output = pair
+    try:
+        if os.path.isdir(input):
+            os.makedirs(output, exist_ok=True)
+            dir_converter(direction, cache_dir, cache_size, detokenize)(input, output)
+        elif os.path.isfile(input):
+            if os.path.isdir(output):
+                output = os.path.join(output, os.path.basename(input))
+            parent = os.path.dirname(output)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            file_converter(direction, input, cache_dir, cache_size, detokenize)(input, output)
+        else:
+            return input, output, 'No such file or directory'
+    except Exception as e:
+        return input, output, f'{type(e).__name__}: {e}'
+    finally:
+        # Worker processes don't run atexit handlers
+        if cache_dir:
+            open_cache(cache_dir, cache_size).flush()
+    return input, output, None
+
+
+def run_batch(pairs: Iterable[tuple[str, str]], direction: str, jobs: int | None = None,
+              cache_dir: str | None = None, cache_size: int | None = None,
+              detokenize: bool = False) -> Iterator[tuple[str, str, str | None]]:
+    '''
+    Converts all pairs and yields the result of each one, in order
+    '''
+    pairs = list(pairs)
+    worker = partial(convert_pair, direction=direction, cache_dir=cache_dir, cache_size=cache_size,
+                     detokenize=detokenize)
+
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(pairs) <= 1:
+        yield from map(worker, pairs)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(pairs))) as executor:
+        yield from executor.map(worker, pairs, chunksize=chunksize)
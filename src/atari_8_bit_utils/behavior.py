@@ -1,6 +1,7 @@
 from __future__ import annotations
 from enum import Enum
-from collections.abc import Callable
+from collections.abc import Awaitable, Callable
+import inspect
 # from typing import TypeAlias
 
 
@@ -20,14 +21,17 @@ class Behavior:
     def apply(self) -> Result:
         return Result.FAILURE
 
+    async def apply_async(self) -> Result:
+        return self.apply()
+
     def __init__(self, name: str, predicate: Callable[[], bool] = NEVER) -> None:
         self.name: str = name
         self.predicate: Callable[[], bool] = predicate
 
 
 class Leaf(Behavior):
-    def __init__(self, action: Callable[[], Result], **kwds) -> None:
-        self.action: Callable[[], Result] = action
+    def __init__(self, action: Callable[[], Result | Awaitable[Result]], **kwds) -> None:
+        self.action: Callable[[], Result | Awaitable[Result]] = action
         super().__init__(**kwds)
 
     def apply(self) -> Result:
@@ -35,6 +39,12 @@ class Leaf(Behavior):
         # print(f'Callable[[], Result] {self.name} done with result {result}')
         return result
 
+    async def apply_async(self) -> Result:
+        result = self.action()
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
 
 class Sequence(Behavior):
 
@@ -53,6 +63,16 @@ class Sequence(Behavior):
         # print(f'Sequence: {self.name} -> {result}')
         return result
 
+    async def apply_async(self) -> Result:
+        todo = self.behaviors.copy()
+
+        result = Result.SUCCESS
+        while todo and result == Result.SUCCESS:
+            action = todo.pop(0)
+            result = (await action.apply_async()) if action.should_run() else Result.FAILURE
+
+        return result
+
 
 class Selector(Behavior):
 
@@ -74,6 +94,18 @@ class Selector(Behavior):
         # print(f'Selector: {self.name} -> {result}')
         return result
 
+    async def apply_async(self) -> Result:
+        todo = self.behaviors.copy()
+
+        result: Result = Result.FAILURE
+
+        while todo and result == Result.FAILURE:
+            action = todo.pop(0)
+            if action.should_run():
+                result = await action.apply_async()
+
+        return result
+
 
 class BehaviorTree:
 
@@ -103,3 +135,6 @@ class BehaviorTree:
 
     def tick(self) -> Result:
         return self.root.apply() if self.root.should_run() else Result.FAILURE
+
+    async def tick_async(self) -> Result:
+        return (await self.root.apply_async()) if self.root.should_run() else Result.FAILURE
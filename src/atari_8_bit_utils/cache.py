@@ -0,0 +1,255 @@
+from __future__ import annotations
+from collections.abc import Callable
+import atexit
+import errno
+import hashlib
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from .atascii import inv_translate, translate
+
+# Default size limit of the cache in bytes
+default_max_size = 256 * 1024 * 1024
+
+# Linux ioctl used to make a copy-on-write clone of a file (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+# Cleared once the cache directory's filesystem turns out not to support reflinks
+reflinks = True
+
+# Hits only update the last use time and the hit/miss totals in memory. They are
+# written to the index in a single transaction once this many are pending, after
+# this many seconds, or when the conversion run ends.
+flush_every = 256
+flush_interval = 10.0
+
+# The cache keys include a hash of the mapping tables, so that any change to the
+# mappings automatically invalidates previously converted output.
+tables_version = hashlib.sha256(repr((sorted(translate.items()), sorted(inv_translate.items()))).encode('utf-8')).hexdigest()[:16]
+
+# One Cache instance per directory, shared by every converter in the process
+caches: dict[str, Cache] = {}
+caches_lock = threading.Lock()
+
+
+def open_cache(path: str, max_size: int | None = None) -> Cache:
+    '''
+    Returns the shared Cache instance for the given directory
+    '''
+    path = os.path.abspath(os.path.expanduser(path))
+    with caches_lock:
+        cache = caches.get(path)
+        if cache is None:
+            cache = Cache(path, max_size)
+            caches[path] = cache
+            atexit.register(cache.flush)
+        elif max_size:
+            cache.max_size = max_size
+        return cache
+
+
+class Cache:
+    '''
+    Content addressed on-disk cache of converted files. Entries are keyed by the
+    SHA-256 of the source file and the direction of the conversion ('utf8' or
+    'atascii'), and evicted in least recently used order once the cache grows
+    beyond max_size bytes.
+
+    Cached output is materialized as a reflink where the filesystem supports it,
+    and as a plain copy otherwise. Either way the output is a separate, writable
+    file, so editing it never changes the cache entry.
+    '''
+
+    def __init__(self, path: str, max_size: int | None = None) -> None:
+        self.path = path
+        self.max_size = max_size or default_max_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # Not yet written to the index: last use time by key and counter increments
+        self.touched: dict[str, float] = {}
+        self.counts: dict[str, int] = {}
+        self.flushed = time.monotonic()
+
+        os.makedirs(self.path, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(self.path, 'index.sqlite'), timeout=30, check_same_thread=False)
+        # Worker processes share the index, WAL lets them read while one writes
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER, last_used REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)')
+
+    def key(self, data: bytes, direction: str) -> str:
+        return f'{direction}-{tables_version}-{hashlib.sha256(data).hexdigest()}'
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.path, key[-2:], key)
+
+    def get(self, key: str) -> str | None:
+        '''
+        Returns the path of the cached file for key, or None on a miss
+        '''
+        path = self.entry_path(key)
+        # The entry file is the source of truth. If it was removed behind our back,
+        # put() replaces the stale row after the conversion.
+        found = os.path.isfile(path)
+        with self.lock:
+            if found:
+                self.hits += 1
+                self.touched[key] = time.time()
+            else:
+                self.misses += 1
+            self.count('hits' if found else 'misses')
+            due = len(self.touched) >= flush_every or time.monotonic() - self.flushed >= flush_interval
+        if due:
+            self.flush()
+        return path if found else None
+
+    def put(self, key: str, filename: str) -> str:
+        '''
+        Moves filename into the cache as the entry for key and returns the new path
+        '''
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.name != 'nt':
+            os.chmod(filename, 0o444)
+        os.replace(filename, path)
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)', (key, os.path.getsize(path), time.time()))
+        return path
+
+    def count(self, name: str):
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def flush(self):
+        '''
+        Writes the pending last use times and hit/miss counts to the index
+        '''
+        with self.lock:
+            self.flushed = time.monotonic()
+            if not self.touched and not self.counts:
+                return
+            with self.db:
+                self.db.executemany('UPDATE entries SET last_used = ? WHERE key = ?',
+                                    [(used, key) for key, used in self.touched.items()])
+                self.db.executemany('INSERT INTO stats VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?',
+                                    [(name, n, n) for name, n in self.counts.items()])
+            self.touched = {}
+            self.counts = {}
+
+    def size(self) -> int:
+        with self.lock:
+            return self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def evict(self):
+        '''
+        Removes the least recently used entries until the cache is below 90% of max_size
+        '''
+        total = self.size()
+        if total <= self.max_size:
+            return
+
+        # The last use times have to be up to date for the order
+        self.flush()
+
+        target = self.max_size * 0.9
+        with self.lock, self.db:
+            for key, size in self.db.execute('SELECT key, size FROM entries ORDER BY last_used').fetchall():
+                if total <= target:
+                    break
+                try:
+                    os.remove(self.entry_path(key))
+                except FileNotFoundError:
+                    pass
+                self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                total -= size
+
+    def clear(self):
+        with self.lock, self.db:
+            self.touched = {}
+            self.counts = {}
+            for (key,) in self.db.execute('SELECT key FROM entries').fetchall():
+                try:
+                    os.remove(self.entry_path(key))
+                except FileNotFoundError:
+                    pass
+            self.db.execute('DELETE FROM entries')
+            self.db.execute('DELETE FROM stats')
+
+    def stats(self) -> dict:
+        self.flush()
+        with self.lock:
+            entries, size = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+            totals = dict(self.db.execute('SELECT name, value FROM stats').fetchall())
+        return {
+            'path': self.path,
+            'entries': entries,
+            'size': size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'total_hits': totals.get('hits', 0),
+            'total_misses': totals.get('misses', 0)
+        }
+
+    def converter(self, direction: str, convert: Callable[[str, str], None]) -> Callable[[str, str], None]:
+        '''
+        Wraps a file converter such as to_utf8 so that its output is served from the cache
+        '''
+        def cached(in_filename='-', out_filename='-'):
+            # There's nothing to key on when streaming
+            if in_filename == '-' or out_filename == '-':
+                return convert(in_filename, out_filename)
+
+            f = open(in_filename, 'rb')
+            key = self.key(f.read(), direction)
+            f.close()
+
+            path = self.get(key)
+            if path is None:
+                fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+                os.close(fd)
+                try:
+                    convert(in_filename, tmp)
+                    path = self.put(key, tmp)
+                except BaseException:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                    raise
+                materialize(path, out_filename)
+                self.evict()
+            else:
+                materialize(path, out_filename)
+
+        return cached
+
+
+def materialize(src: str, dst: str):
+    '''
+    Makes dst a reflink or a copy of src. Hard links aren't used, since writes to
+    the output would go through to the cache entry.
+    '''
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    global reflinks
+    if reflinks and sys.platform.startswith('linux'):
+        try:
+            import fcntl
+            with open(src, 'rb') as s, open(dst, 'wb') as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            return
+        except OSError as e:
+            if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV):
+                # Don't try again for every file
+                reflinks = False
+            if os.path.lexists(dst):
+                os.remove(dst)
+
+    shutil.copyfile(src, dst)
@@ -0,0 +1,197 @@
+from __future__ import annotations
+from collections import deque
+import json
+import signal
+import socket
+import socketserver
+import threading
+import time
+
+# Commands understood by the control channel. Each command is sent as a single
+# line of text and answered with a single line of JSON.
+COMMANDS = ['tick', 'pause', 'resume', 'status', 'shutdown']
+
+
+class Controller:
+    '''
+    Shared state between the recon loop and the control channel. The recon loop
+    waits on the controller instead of calling time.sleep() directly, so that a
+    'tick' command can wake it up immediately.
+    '''
+
+    def __init__(self, history: int = 20) -> None:
+        self.wakeup = threading.Event()
+        self.resumed = threading.Event()
+        self.resumed.set()
+        self.shutdown_requested = False
+        self.tick_requested = False
+        self.state = 'starting'
+        self.ticks: deque[dict] = deque(maxlen=history)
+        self.lock = threading.Lock()
+
+    def trigger(self):
+        self.tick_requested = True
+        self.wakeup.set()
+
+    def pause(self):
+        self.resumed.clear()
+
+    def resume(self):
+        self.resumed.set()
+        self.wakeup.set()
+
+    def shutdown(self):
+        self.shutdown_requested = True
+        self.resume()
+
+    @property
+    def paused(self) -> bool:
+        return not self.resumed.is_set()
+
+    def sleep(self, delay: float) -> str | None:
+        '''
+        Sleeps for up to delay seconds. Returns the reason if we were woken up
+        early: 'tick' for a trigger, 'wakeup' for a pause/resume or shutdown
+        request. The tick request is cleared here, so callers that need to know
+        about it must use the return value.
+        '''
+        self.state = 'waiting'
+        woken = self.wakeup.wait(delay)
+        return self.woken_by() if woken else None
+
+    def woken_by(self) -> str:
+        reason = 'tick' if self.tick_requested else 'wakeup'
+        self.wakeup.clear()
+        self.tick_requested = False
+        return reason
+
+    def wait_if_paused(self):
+        while self.paused and not self.shutdown_requested:
+            self.state = 'paused'
+            self.resumed.wait(1)
+
+    async def sleep_async(self, delay: float, poll: float = 0.05) -> str | None:
+        '''
+        Same as sleep(), but without blocking the event loop. The events are
+        polled rather than waited on in an executor, so that the sleep can be
+        cancelled immediately.
+        '''
+        # Only the asyncio engine needs this, and the CLI imports this module on startup
+        import asyncio
+        self.state = 'waiting'
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + delay
+        while not self.wakeup.is_set() and loop.time() < deadline:
+            await asyncio.sleep(min(poll, max(deadline - loop.time(), 0)))
+        return self.woken_by() if self.wakeup.is_set() else None
+
+    async def wait_if_paused_async(self, poll: float = 0.05):
+        import asyncio
+        while self.paused and not self.shutdown_requested:
+            self.state = 'paused'
+            await asyncio.sleep(poll)
+
+    def record_tick(self, started: float, duration: float, iteration: int, project: str | None = None):
+        tick = {
+            'iteration': iteration,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+            'duration': round(duration, 6)
+        }
+        if project is not None:
+            tick['project'] = project
+        with self.lock:
+            self.ticks.append(tick)
+
+    def status(self) -> dict:
+        with self.lock:
+            ticks = list(self.ticks)
+        return {
+            'state': self.state,
+            'paused': self.paused,
+            'shutdown_requested': self.shutdown_requested,
+            'ticks': ticks
+        }
+
+    def handle(self, command: str) -> dict:
+        command = command.strip().lower()
+        if command == 'tick':
+            self.trigger()
+        elif command == 'pause':
+            self.pause()
+        elif command == 'resume':
+            self.resume()
+        elif command == 'shutdown':
+            self.shutdown()
+        elif command != 'status':
+            return {'ok': False, 'error': f'Unknown command "{command}". Expected one of {COMMANDS}'}
+        return {'ok': True} | self.status()
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            command = line.decode('utf-8', errors='replace')
+            if not command.strip():
+                continue
+            response = self.server.controller.handle(command)
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class ControlServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, controller: Controller, port: int) -> None:
+        self.controller = controller
+        # Only ever listen on the loopback interface. There is no authentication.
+        super().__init__(('127.0.0.1', port), ControlHandler)
+
+
+def start_server(controller: Controller, port: int) -> ControlServer:
+    '''
+    Starts the control channel on 127.0.0.1:port in a background thread
+    '''
+    server = ControlServer(controller, port)
+    thread = threading.Thread(target=server.serve_forever, name='a8utils-control', daemon=True)
+    thread.start()
+    print(f'Control channel listening on 127.0.0.1:{server.server_address[1]}')
+    return server
+
+
+def install_signal_handlers(controller: Controller):
+    '''
+    Signal based fallback for platforms or setups where the control socket isn't
+    available. SIGUSR1 triggers a tick, SIGUSR2 toggles pause and SIGTERM requests
+    a clean shutdown. Only the signals supported by the current platform are used.
+    '''
+    if threading.current_thread() is not threading.main_thread():
+        return
+
+    def toggle_pause():
+        controller.resume() if controller.paused else controller.pause()
+
+    handlers = {
+        'SIGUSR1': controller.trigger,
+        'SIGUSR2': toggle_pause,
+        'SIGTERM': controller.shutdown
+    }
+    for name, handler in handlers.items():
+        signum = getattr(signal, name, None)
+        if signum is not None:
+            signal.signal(signum, lambda s, f, h=handler: h())
+
+
+def send_command(command: str, port: int, timeout: float = 5) -> dict:
+    '''
+    Sends a single command to a running control channel and returns the response
+    '''
+    with socket.create_connection(('127.0.0.1', port), timeout=timeout) as sock:
+        sock.sendall((command + '\n').encode('utf-8'))
+        response = b''
+        while not response.endswith(b'\n'):
+            data = sock.recv(4096)
+            if not data:
+                break
+            response += data
+    return json.loads(response.decode('utf-8'))
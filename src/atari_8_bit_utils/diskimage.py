@@ -0,0 +1,447 @@
+from __future__ import annotations
+from collections.abc import Iterator
+from typing import BinaryIO
+import os
+import re
+import struct
+
+# Readers for Atari disk images (ATR, XFD, DCM and ATX) and an extractor for
+# Atari DOS 2 compatible file systems (DOS 2.0/2.5, MyDOS) on those images.
+#
+# Every reader decodes its image front to back in a single pass and yields
+# (sector number, data) pairs, so compressed DCM and track based ATX images are
+# never expanded to a full ATR first. The DOS directory lives in the middle of
+# the disk, so Disk keeps the non-empty sectors in a sparse map. Memory is
+# bounded by the used capacity of the disk.
+
+# Disk images picked up by the sync process
+image_pattern = '\\.(atr|xfd|dcm|atx)$'
+
+
+class ImageError(Exception):
+    pass
+
+
+class SectorStream:
+    '''
+    Sectors of a disk image, in the order in which they are stored
+    '''
+
+    def __init__(self, sector_size: int, sectors: Iterator[tuple[int, bytes]]) -> None:
+        self.sector_size = sector_size
+        self.sectors = sectors
+
+    def __iter__(self) -> Iterator[tuple[int, bytes]]:
+        return self.sectors
+
+
+def read_exactly(f: BinaryIO, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise ImageError('Unexpected end of image')
+    return data
+
+
+def boot_sector_size(sector_size: int, data_size: int) -> int:
+    '''
+    Double density images usually store the three boot sectors as 128 bytes, but
+    some pad them to 256 bytes. The total size tells us which it is.
+    '''
+    if sector_size > 128 and data_size % sector_size != 0:
+        return 128
+    return sector_size
+
+
+def linear_sectors(f: BinaryIO, sector_size: int, data_size: int) -> Iterator[tuple[int, bytes]]:
+    boot_size = boot_sector_size(sector_size, data_size)
+    count = 3 + (data_size - 3 * boot_size) // sector_size if data_size >= 3 * boot_size else data_size // boot_size
+    for sector in range(1, count + 1):
+        size = boot_size if sector <= 3 else sector_size
+        data = f.read(size)
+        if len(data) < size:
+            break
+        # Padded boot sectors only hold 128 bytes of data
+        yield sector, data[:128] if sector <= 3 else data
+
+
+def read_atr(f: BinaryIO) -> SectorStream:
+    header = read_exactly(f, 16)
+    if header[0:2] != b'\x96\x02':
+        raise ImageError('Not an ATR image')
+    paragraphs = header[2] | header[3] << 8 | header[6] << 16
+    sector_size = header[4] | header[5] << 8
+    return SectorStream(sector_size, linear_sectors(f, sector_size, paragraphs * 16))
+
+
+def read_xfd(f: BinaryIO, size: int) -> SectorStream:
+    '''
+    XFD images are raw sector dumps without a header, so the density follows from the size
+    '''
+    if size % 128 == 0 and size <= 1040 * 128:
+        sector_size = 128
+    elif (size - 3 * 128) % 256 == 0 or size % 256 == 0:
+        sector_size = 256
+    else:
+        raise ImageError(f'Unexpected XFD image size {size}')
+    return SectorStream(sector_size, linear_sectors(f, sector_size, size))
+
+
+# Sector size and number of sectors for the density in a DCM pass header
+dcm_densities = {
+    0: (128, 720),
+    1: (256, 720),
+    2: (128, 1040)
+}
+
+
+def read_dcm(f: BinaryIO) -> SectorStream:
+    '''
+    DiskComm images hold one or more passes, each a sequence of sector records that
+    are (delta) compressed against the previously decoded sector
+    '''
+    header = read_exactly(f, 4)
+    if header[0] not in (0xf9, 0xfa):
+        raise ImageError('Not a DCM image')
+    density = (header[1] >> 5) & 0x03
+    if density not in dcm_densities:
+        raise ImageError(f'Unknown DCM density {density}')
+    sector_size, _ = dcm_densities[density]
+
+    def sectors() -> Iterator[tuple[int, bytes]]:
+        pass_info, sector = header[1], header[2] | header[3] << 8
+        buffer = bytearray(sector_size)
+        while True:
+            record = read_exactly(f, 1)[0]
+            kind = record & 0x7f
+            if kind == 0x45:
+                # End of pass
+                if pass_info & 0x80:
+                    return
+                next_pass = f.read(4)
+                if len(next_pass) < 4:
+                    return
+                pass_info, sector = next_pass[1], next_pass[2] | next_pass[3] << 8
+                continue
+
+            size = 128 if sector <= 3 else sector_size
+            decode_dcm_record(f, kind, buffer, size)
+            yield sector, bytes(buffer[:size])
+
+            if record & 0x80:
+                sector += 1
+            else:
+                low, high = read_exactly(f, 2)
+                sector = low | high << 8
+
+    return SectorStream(sector_size, sectors())
+
+
+def decode_dcm_record(f: BinaryIO, kind: int, buffer: bytearray, size: int):
+    if kind == 0x41:
+        # Change the beginning of the sector. The bytes are stored in reverse order
+        offset = read_exactly(f, 1)[0]
+        data = read_exactly(f, offset + 1)
+        buffer[0:offset + 1] = data[::-1]
+    elif kind == 0x42:
+        # DOS sector: all but the last 5 bytes filled with one value
+        fill = read_exactly(f, 1)[0]
+        buffer[0:size - 5] = bytes([fill]) * (size - 5)
+        buffer[size - 5:size] = read_exactly(f, 5)
+    elif kind == 0x43:
+        # Run length compressed: alternating literal runs and fill runs, each
+        # given by its end offset. The first offset is a plain byte, so 0 is an
+        # empty literal run for sectors that start with a fill run. After that, an
+        # offset of 0 means the end of the sector.
+        position = 0
+        end = read_exactly(f, 1)[0]
+        while True:
+            buffer[position:end] = read_exactly(f, max(end - position, 0))
+            position = max(position, end)
+            if position >= size:
+                break
+            end, fill = read_exactly(f, 2)
+            end = end or size
+            buffer[position:end] = bytes([fill]) * max(end - position, 0)
+            position = max(position, end)
+            if position >= size:
+                break
+            end = read_exactly(f, 1)[0] or size
+    elif kind == 0x44:
+        # Change the end of the sector
+        offset = read_exactly(f, 1)[0]
+        buffer[offset:size] = read_exactly(f, size - offset)
+    elif kind == 0x46:
+        # Same as the previous sector
+        pass
+    elif kind == 0x47:
+        # Uncompressed
+        buffer[0:size] = read_exactly(f, size)
+    else:
+        raise ImageError(f'Unknown DCM record type {kind:#04x}')
+
+
+# Sectors per track and sector size for the density in an ATX header
+atx_densities = {
+    0: (18, 128),
+    1: (26, 128),
+    2: (18, 256)
+}
+
+ATX_SECTOR_LIST = 0x01
+ATX_MISSING_DATA = 0x10
+
+
+def read_atx(f: BinaryIO) -> SectorStream:
+    '''
+    ATX images hold one record per track, with the sector data and a list of
+    sector headers. Only the data is used, timing and weak bits are ignored.
+    '''
+    header = read_exactly(f, 48)
+    if header[0:4] != b'AT8X':
+        raise ImageError('Not an ATX image')
+    density = header[18]
+    if density not in atx_densities:
+        raise ImageError(f'Unknown ATX density {density}')
+    sectors_per_track, sector_size = atx_densities[density]
+    start, end = struct.unpack_from('<II', header, 28)
+
+    def sectors() -> Iterator[tuple[int, bytes]]:
+        position = 48
+        if start > position:
+            read_exactly(f, start - position)
+            position = start
+        while not end or position < end:
+            size_bytes = f.read(4)
+            if len(size_bytes) < 4:
+                return
+            size = struct.unpack('<I', size_bytes)[0]
+            if size < 8:
+                return
+            # Only one track is kept in memory at a time
+            record = size_bytes + read_exactly(f, size - 4)
+            position += size
+            if struct.unpack_from('<H', record, 4)[0] != 0:
+                continue
+            yield from atx_track(record, sectors_per_track, sector_size)
+
+    return SectorStream(sector_size, sectors())
+
+
+def atx_track(record: bytes, sectors_per_track: int, sector_size: int) -> Iterator[tuple[int, bytes]]:
+    track = record[8]
+    header_size = struct.unpack_from('<I', record, 20)[0]
+    found: dict[int, bytes] = {}
+    chunk = header_size
+    while chunk + 8 <= len(record):
+        size, kind = struct.unpack_from('<IB', record, chunk)
+        if size == 0:
+            break
+        if kind == ATX_SECTOR_LIST:
+            for entry in range(chunk + 8, min(chunk + size, len(record)) - 7, 8):
+                number, status, _, data_start = struct.unpack_from('<BBHI', record, entry)
+                if status & ATX_MISSING_DATA or number in found:
+                    continue
+                # Copy protected disks can hold more than one copy of a sector. Use the first.
+                found[number] = record[data_start:data_start + sector_size]
+        chunk += size
+    for number in sorted(found):
+        yield track * sectors_per_track + number, found[number]
+
+
+readers = {
+    '.atr': read_atr,
+    '.dcm': read_dcm,
+    '.atx': read_atx
+}
+
+
+def read_image(f: BinaryIO, name: str = '', size: int | None = None) -> SectorStream:
+    '''
+    Returns the sector stream for an open image, based on the extension of name,
+    or on the first bytes of the image if the extension isn't known
+    '''
+    ext = os.path.splitext(name)[1].lower()
+    if ext == '.xfd':
+        return read_xfd(f, size if size is not None else os.fstat(f.fileno()).st_size)
+    if ext in readers:
+        return readers[ext](f)
+
+    magic = f.read(4)
+    f.seek(-len(magic), os.SEEK_CUR)
+    if magic[:2] == b'\x96\x02':
+        return read_atr(f)
+    if magic[:4] == b'AT8X':
+        return read_atx(f)
+    if magic[:1] in (b'\xf9', b'\xfa'):
+        return read_dcm(f)
+    raise ImageError(f'Unknown disk image format: {name}')
+
+
+class Disk:
+    '''
+    Random access to the sectors of an image, decoded from a single pass over its
+    sector stream. Empty sectors aren't stored.
+    '''
+
+    def __init__(self, stream: SectorStream) -> None:
+        self.sector_size = stream.sector_size
+        self.sectors: dict[int, bytes] = {}
+        for number, data in stream:
+            if any(data):
+                self.sectors[number] = data
+
+    @classmethod
+    def open(cls, path: str) -> Disk:
+        f = open(path, 'rb')
+        try:
+            return cls(read_image(f, path, os.fstat(f.fileno()).st_size))
+        finally:
+            f.close()
+
+    def sector(self, number: int) -> bytes:
+        size = 128 if number <= 3 else self.sector_size
+        data = self.sectors.get(number)
+        if data is None:
+            return bytes(size)
+        return data.ljust(size, b'\0')
+
+
+# Atari DOS 2 directory entry flags
+FLAG_OPEN = 0x01
+FLAG_DOS2 = 0x02
+FLAG_LONG_LINKS = 0x04
+FLAG_SUBDIR = 0x10
+FLAG_LOCKED = 0x20
+FLAG_IN_USE = 0x40
+FLAG_DELETED = 0x80
+
+DIRECTORY_SECTOR = 361
+DIRECTORY_SECTORS = 8
+
+
+class DirEntry:
+    def __init__(self, index: int, data: bytes, path: str = '') -> None:
+        self.index = index
+        self.flags = data[0]
+        self.count, self.start = struct.unpack_from('<HH', data, 1)
+        self.name = data[5:13].decode('latin-1').rstrip()
+        self.ext = data[13:16].decode('latin-1').rstrip()
+        self.path = path
+
+    @property
+    def filename(self) -> str:
+        return f'{self.name}.{self.ext}' if self.ext else self.name
+
+    @property
+    def is_dir(self) -> bool:
+        return bool(self.flags & FLAG_SUBDIR)
+
+    def __repr__(self) -> str:
+        return f'DirEntry({os.path.join(self.path, self.filename)!r}, sectors={self.count}, start={self.start})'
+
+
+class Dos2:
+    '''
+    Read only view of an Atari DOS 2 compatible file system, including MyDOS
+    subdirectories and 16 bit sector links
+    '''
+
+    def __init__(self, disk: Disk) -> None:
+        self.disk = disk
+
+    def directory(self, start: int = DIRECTORY_SECTOR, path: str = '') -> Iterator[DirEntry]:
+        for i in range(DIRECTORY_SECTORS):
+            sector = self.disk.sector(start + i)
+            for j in range(8):
+                data = sector[j * 16:(j + 1) * 16]
+                if data[0] == 0:
+                    return
+                if data[0] & FLAG_DELETED or not data[0] & FLAG_IN_USE:
+                    continue
+                yield DirEntry(i * 8 + j, data, path)
+
+    def walk(self, start: int = DIRECTORY_SECTOR, path: str = '', depth: int = 0) -> Iterator[DirEntry]:
+        '''
+        Yields all files and directories, depth first
+        '''
+        for entry in self.directory(start, path):
+            yield entry
+            if entry.is_dir and depth < 16:
+                yield from self.walk(entry.start, os.path.join(path, entry.filename), depth + 1)
+
+    def sectors(self, entry: DirEntry) -> Iterator[tuple[int, bytes]]:
+        '''
+        Yields the sector numbers of a file and the file data in each of them
+        '''
+        sector = entry.start
+        seen = set()
+        while sector and sector not in seen:
+            seen.add(sector)
+            data = self.disk.sector(sector)
+            size = len(data)
+            link, low, count = data[size - 3], data[size - 2], data[size - 1]
+            yield sector, data[:min(count, size - 3)]
+            if entry.flags & FLAG_LONG_LINKS:
+                sector = link << 8 | low
+            else:
+                sector = (link & 0x03) << 8 | low
+
+    def read(self, entry: DirEntry) -> Iterator[bytes]:
+        '''
+        Yields the contents of a file, one sector at a time
+        '''
+        for _, data in self.sectors(entry):
+            yield data
+
+    def extract(self, opath: str) -> list[str]:
+        '''
+        Writes all files to opath and returns their paths relative to opath
+        '''
+        written = []
+        for entry in self.walk():
+            if not is_safe_name(entry.filename):
+                raise ImageError(f'Refusing to extract {os.path.join(entry.path, entry.filename)!r}')
+            target = os.path.join(opath, entry.path, entry.filename)
+            if entry.is_dir:
+                os.makedirs(target, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            f = open(target, 'wb')
+            for chunk in self.read(entry):
+                f.write(chunk)
+            f.close()
+            written.append(os.path.join(entry.path, entry.filename))
+        return written
+
+
+def is_safe_name(name: str) -> bool:
+    '''
+    Directory entries are raw bytes, so a crafted image could otherwise write
+    outside the output directory
+    '''
+    if name in ('', '.', '..') or '\0' in name:
+        return False
+    return not any(sep in name for sep in ('/', '\\', os.sep, os.altsep) if sep)
+
+
+def extract_image(path: str, opath: str) -> list[str]:
+    '''
+    Extracts all files from a disk image to opath
+    '''
+    return Dos2(Disk.open(path)).extract(opath)
+
+
+def list_image(path: str) -> Iterator[DirEntry]:
+    return Dos2(Disk.open(path)).walk()
+
+
+def is_image(name: str) -> bool:
+    return re.search(image_pattern, name) is not None
+
+
+def is_atr(name: str) -> bool:
+    '''
+    ATR images are extracted with lsatr, which also knows SpartaDOS and other file
+    systems. The other formats use the built in DOS 2 extractor.
+    '''
+    return name.lower().endswith('.atr')
@@ -0,0 +1,166 @@
+from __future__ import annotations
+from collections.abc import Iterable, Iterator
+import hashlib
+import os
+import re
+import time
+
+# Compact records of the files in a directory, as stored in state.json, and a
+# linear diff between two of them.
+#
+# A DirState is kept sorted by name, so two states can be compared with a single
+# merge pass. Files whose size and modification time didn't change since the
+# previous scan keep their checksum, so only changed files are read again.
+
+# Files modified this close to a scan may be modified again within the timestamp
+# resolution of the file system, so their checksum is never reused.
+racy_seconds = 2.0
+
+
+class FileState:
+    __slots__ = ('name', 'checksum', 'size', 'mtime')
+
+    def __init__(self, name: str, checksum: str, size: int = -1, mtime: int = -1) -> None:
+        self.name = name
+        self.checksum = checksum
+        # Only known for files that were scanned by this process
+        self.size = size
+        self.mtime = mtime
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, FileState):
+            return NotImplemented
+        return self.name == other.name and self.checksum == other.checksum
+
+    def __hash__(self) -> int:
+        return hash((self.name, self.checksum))
+
+    def __repr__(self) -> str:
+        return f'FileState({self.name!r}, {self.checksum!r})'
+
+    def to_json(self) -> dict:
+        return {
+            'name': self.name,
+            'checksum': self.checksum
+        }
+
+
+class Changeset:
+    '''
+    Names of the files that were added, removed or modified between two states
+    '''
+    __slots__ = ('added', 'removed', 'modified')
+
+    def __init__(self, added: list[str], removed: list[str], modified: list[str]) -> None:
+        self.added = added
+        self.removed = removed
+        self.modified = modified
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.modified)
+
+    def __repr__(self) -> str:
+        return f'Changeset(added={self.added}, removed={self.removed}, modified={self.modified})'
+
+
+class DirState:
+    '''
+    The files of a single directory, sorted by name
+    '''
+    __slots__ = ('files', 'scanned')
+
+    def __init__(self, files: Iterable[FileState] = (), scanned: float = 0.0) -> None:
+        self.files = sorted(files, key=lambda f: f.name)
+        # Time of the scan that produced this state, 0 if it was loaded from state.json
+        self.scanned = scanned
+
+    @classmethod
+    def from_json(cls, entries: list | None) -> DirState | None:
+        if entries is None:
+            return None
+        return cls(FileState(entry['name'], entry['checksum']) for entry in entries)
+
+    def to_json(self) -> list:
+        return [f.to_json() for f in self.files]
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __iter__(self) -> Iterator[FileState]:
+        return iter(self.files)
+
+    def __getitem__(self, index: int) -> FileState:
+        return self.files[index]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, list):
+            other = DirState.from_json(other)
+        if not isinstance(other, DirState):
+            return NotImplemented
+        return self.files == other.files
+
+    def __repr__(self) -> str:
+        return f'DirState({self.files})'
+
+    def names(self) -> list[str]:
+        return [f.name for f in self.files]
+
+    def filter(self, name: str) -> DirState:
+        return DirState([f for f in self.files if f.name == name], self.scanned)
+
+
+def diff(old: DirState | None, new: DirState | None) -> Changeset:
+    '''
+    Compares two states in a single merge pass over both sorted lists
+    '''
+    old_files = old.files if old else []
+    new_files = new.files if new else []
+    added, removed, modified = [], [], []
+    i = j = 0
+    while i < len(old_files) and j < len(new_files):
+        a, b = old_files[i], new_files[j]
+        if a.name == b.name:
+            if a.checksum != b.checksum:
+                modified.append(a.name)
+            i += 1
+            j += 1
+        elif a.name < b.name:
+            removed.append(a.name)
+            i += 1
+        else:
+            added.append(b.name)
+            j += 1
+    removed.extend(f.name for f in old_files[i:])
+    added.extend(f.name for f in new_files[j:])
+    return Changeset(added, removed, modified)
+
+
+def md5checksum(file):
+    f = open(file, 'rb')
+    checksum = hashlib.md5(f.read()).hexdigest()
+    f.close()
+    return checksum
+
+
+def scan(path: str, pattern: str = '.*', previous: DirState | None = None) -> tuple[DirState, int]:
+    '''
+    Returns the state of every matching file in path, and the number of bytes that
+    were hashed. Checksums of files that are unchanged since previous are reused.
+    '''
+    started = time.time()
+    known = {f.name: f for f in previous} if previous and previous.scanned else {}
+    files = []
+    hashed = 0
+    with os.scandir(path) as dir:
+        for entry in dir:
+            if entry.name.startswith('.') or not entry.is_file() or re.search(pattern, entry.name) is None:
+                continue
+            stat = entry.stat()
+            old = known.get(entry.name)
+            if (old is not None and old.size == stat.st_size and old.mtime == stat.st_mtime_ns
+                    and stat.st_mtime_ns / 1e9 < previous.scanned - racy_seconds):
+                files.append(old)
+                continue
+            files.append(FileState(entry.name, md5checksum(entry.path), stat.st_size, stat.st_mtime_ns))
+            hashed += stat.st_size
+    return DirState(files, started), hashed
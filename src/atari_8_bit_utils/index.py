@@ -0,0 +1,226 @@
+from __future__ import annotations
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import io
+import os
+import re
+import sqlite3
+from .atascii import bytes_to_utf8
+from .diskimage import Disk, Dos2, image_pattern, read_image
+
+# Searchable index of the files on a collection of disk images. For every file we
+# store its name, size, MD5 checksum (the same checksum sync stores in
+# state.json) and the sectors it occupies. The UTF-8 conversion of every distinct
+# file is stored once, for substring searches.
+#
+# Images are only read again when their size or modification time changed, and
+# their files are only replaced when the checksum of the image changed too.
+
+# Number of images handed to a worker at a time
+chunksize = 8
+
+# The trigram tokenizer needs SQLite 3.34 or later. Without it, content searches
+# fall back to a full scan with LIKE.
+trigram_version = (3, 34, 0)
+
+
+def format_sectors(sectors: list[int]) -> str:
+    '''
+    Formats a list of sector numbers as ranges, e.g. "4-9,14"
+    '''
+    ranges = []
+    for sector in sectors:
+        if ranges and sector == ranges[-1][1] + 1:
+            ranges[-1][1] = sector
+        else:
+            ranges.append([sector, sector])
+    return ','.join(str(start) if start == end else f'{start}-{end}' for start, end in ranges)
+
+
+def read_files(path: str) -> tuple[str, str | None, list[tuple], str | None]:
+    '''
+    Reads a disk image and returns its path, its checksum, one tuple of path, name,
+    size, checksum, sector ranges and UTF-8 text per file, and an error message
+    '''
+    try:
+        f = open(path, 'rb')
+        data = f.read()
+        f.close()
+        checksum = hashlib.md5(data).hexdigest()
+        fs = Dos2(Disk(read_image(io.BytesIO(data), path, len(data))))
+        files = []
+        for entry in fs.walk():
+            if entry.is_dir:
+                continue
+            sectors, chunks = [], []
+            for sector, chunk in fs.sectors(entry):
+                sectors.append(sector)
+                chunks.append(chunk)
+            content = b''.join(chunks)
+            name = entry.filename
+            file_path = '/'.join(entry.path.split(os.sep) + [name]) if entry.path else name
+            files.append((file_path, name, len(content), hashlib.md5(content).hexdigest(), format_sectors(sectors),
+                          bytes_to_utf8(content)))
+    except Exception as e:
+        return path, None, [], f'{type(e).__name__}: {e}'
+    return path, checksum, files, None
+
+
+def image_files(roots: Iterable[str]) -> Iterator[str]:
+    for root in roots:
+        if not os.path.isdir(root):
+            yield os.path.abspath(root)
+            continue
+        for dirpath, dirs, files in os.walk(root):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for name in sorted(files):
+                if re.search(image_pattern, name, re.IGNORECASE):
+                    yield os.path.abspath(os.path.join(dirpath, name))
+
+
+class Index:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=30)
+        self.trigram = sqlite3.sqlite_version_info >= trigram_version
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS images (id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, '
+                            'mtime INTEGER, checksum TEXT, error TEXT)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS files (image INTEGER, path TEXT, name TEXT, size INTEGER, '
+                            'checksum TEXT, sectors TEXT)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS files_image ON files (image)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS files_name ON files (name)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS files_checksum ON files (checksum)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS contents (id INTEGER PRIMARY KEY, checksum TEXT UNIQUE, text TEXT)')
+            if self.trigram:
+                self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS contents_fts USING fts5(text, tokenize='trigram')")
+
+    def close(self):
+        self.db.close()
+
+    def update(self, roots: list[str], jobs: int | None = None, prune: bool = True) -> dict[str, int]:
+        '''
+        Brings the index up to date with the images in roots. Returns the number of
+        images that were unchanged, touched (only their mtime changed), updated,
+        added, removed and failed.
+        '''
+        stats = dict.fromkeys(['unchanged', 'touched', 'updated', 'added', 'removed', 'failed'], 0)
+        known = {path: (id, size, mtime, checksum) for id, path, size, mtime, checksum
+                 in self.db.execute('SELECT id, path, size, mtime, checksum FROM images')}
+
+        changed = []
+        seen = set()
+        for path in image_files(roots):
+            seen.add(path)
+            stat = os.stat(path)
+            row = known.get(path)
+            if row and row[1] == stat.st_size and row[2] == stat.st_mtime_ns:
+                stats['unchanged'] += 1
+            else:
+                changed.append((path, stat))
+
+        stats_by_path = dict(changed)
+        for path, checksum, files, error in self.read(list(stats_by_path), jobs):
+            stat = stats_by_path[path]
+            row = known.get(path)
+            with self.db:
+                if error:
+                    stats['failed'] += 1
+                elif row and row[3] == checksum:
+                    stats['touched'] += 1
+                    self.db.execute('UPDATE images SET size = ?, mtime = ? WHERE id = ?', (stat.st_size, stat.st_mtime_ns, row[0]))
+                    continue
+                else:
+                    stats['updated' if row else 'added'] += 1
+                self.store(path, stat, checksum, files, error, row[0] if row else None)
+
+        if prune:
+            # Only images below the given roots are removed, so that an archive can be
+            # indexed one directory at a time
+            roots = [os.path.abspath(root) for root in roots]
+            removed = [row[0] for path, row in known.items() if path not in seen
+                       and any(path == root or path.startswith(root + os.sep) for root in roots)]
+            with self.db:
+                for id in removed:
+                    self.db.execute('DELETE FROM files WHERE image = ?', (id,))
+                    self.db.execute('DELETE FROM images WHERE id = ?', (id,))
+            stats['removed'] = len(removed)
+            if removed or stats['updated']:
+                self.prune_contents()
+        return stats
+
+    def read(self, paths: list[str], jobs: int | None) -> Iterator[tuple]:
+        jobs = jobs or os.cpu_count() or 1
+        if jobs == 1 or len(paths) <= 1:
+            yield from map(read_files, paths)
+            return
+        with ProcessPoolExecutor(max_workers=min(jobs, len(paths))) as executor:
+            yield from executor.map(read_files, paths, chunksize=chunksize)
+
+    def store(self, path: str, stat: os.stat_result, checksum: str | None, files: list[tuple], error: str | None,
+              id: int | None):
+        if id is None:
+            id = self.db.execute('INSERT INTO images (path, size, mtime, checksum, error) VALUES (?, ?, ?, ?, ?)',
+                                 (path, stat.st_size, stat.st_mtime_ns, checksum, error)).lastrowid
+        else:
+            self.db.execute('UPDATE images SET size = ?, mtime = ?, checksum = ?, error = ? WHERE id = ?',
+                            (stat.st_size, stat.st_mtime_ns, checksum, error, id))
+            self.db.execute('DELETE FROM files WHERE image = ?', (id,))
+
+        for file_path, name, size, file_checksum, sectors, text in files:
+            self.db.execute('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)', (id, file_path, name, size, file_checksum, sectors))
+            cursor = self.db.execute('INSERT OR IGNORE INTO contents (checksum, text) VALUES (?, ?)', (file_checksum, text))
+            if cursor.rowcount and self.trigram:
+                self.db.execute('INSERT INTO contents_fts (rowid, text) VALUES (?, ?)', (cursor.lastrowid, text))
+
+    def prune_contents(self):
+        '''
+        Removes the text of files that are no longer on any image
+        '''
+        with self.db:
+            orphans = [row[0] for row in self.db.execute(
+                'SELECT id FROM contents WHERE checksum NOT IN (SELECT checksum FROM files)')]
+            for id in orphans:
+                self.db.execute('DELETE FROM contents WHERE id = ?', (id,))
+                if self.trigram:
+                    self.db.execute('DELETE FROM contents_fts WHERE rowid = ?', (id,))
+
+    def search(self, name: str | None = None, checksum: str | None = None, text: str | None = None,
+               limit: int = 1000) -> list[dict]:
+        '''
+        Finds files by name (a glob pattern, case insensitive), checksum (or a prefix
+        of it) and/or a substring of their UTF-8 conversion
+        '''
+        conditions, params = [], []
+        if name:
+            conditions.append('upper(files.name) GLOB ?')
+            params.append(name.upper())
+        if checksum:
+            conditions.append('files.checksum >= ? AND files.checksum < ?')
+            params += [checksum.lower(), checksum.lower() + 'g']
+        if text:
+            if self.trigram and len(text) >= 3:
+                conditions.append('files.checksum IN (SELECT checksum FROM contents WHERE id IN '
+                                  '(SELECT rowid FROM contents_fts WHERE contents_fts MATCH ?))')
+                params.append('"' + text.replace('"', '""') + '"')
+            else:
+                conditions.append("files.checksum IN (SELECT checksum FROM contents WHERE text LIKE ? ESCAPE '\\')")
+                params.append('%' + re.sub(r'([%_\\])', r'\\\1', text) + '%')
+
+        query = ('SELECT images.path, files.path, files.size, files.checksum, files.sectors '
+                 'FROM files JOIN images ON images.id = files.image')
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY images.path, files.path LIMIT ?'
+        params.append(limit)
+        return [{'image': image, 'path': path, 'size': size, 'checksum': file_checksum, 'sectors': sectors}
+                for image, path, size, file_checksum, sectors in self.db.execute(query, params)]
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'images': self.db.execute('SELECT COUNT(*) FROM images').fetchone()[0],
+            'failed': self.db.execute('SELECT COUNT(*) FROM images WHERE error IS NOT NULL').fetchone()[0],
+            'files': self.db.execute('SELECT COUNT(*) FROM files').fetchone()[0],
+            'contents': self.db.execute('SELECT COUNT(*) FROM contents').fetchone()[0]
+        }
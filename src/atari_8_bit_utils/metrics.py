@@ -0,0 +1,199 @@
+from __future__ import annotations
+from collections.abc import Callable
+from contextlib import contextmanager
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in seconds
+buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+# Help text for every metric we export. Metrics without an entry aren't exported
+# to Prometheus, but still show up in the JSON status file.
+descriptions = {
+    'phase_seconds': ('histogram', 'Time spent in each phase of the sync loop'),
+    'hash_bytes_total': ('counter', 'Bytes read to compute checksums'),
+    'converted_bytes_total': ('counter', 'Bytes of ATASCII converted to UTF-8'),
+    'conversion_bytes_per_second': ('gauge', 'Conversion throughput of the last conversion'),
+    'ticks_total': ('counter', 'Number of ticks of the sync loop'),
+    'last_tick_timestamp_seconds': ('gauge', 'Unix time at which the last tick finished'),
+}
+
+prefix = 'a8utils_sync_'
+
+
+class Histogram:
+    def __init__(self) -> None:
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'buckets': dict(zip([str(b) for b in buckets], self.counts))
+        }
+
+
+class Metrics:
+    '''
+    Per project counters, gauges and histograms of the sync loop. Values are keyed
+    by metric name and a tuple of label values.
+    '''
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counters: dict[tuple[str, tuple], float] = {}
+        self.gauges: dict[tuple[str, tuple], float] = {}
+        self.histograms: dict[tuple[str, tuple], Histogram] = {}
+        self.started = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, phase: str, **labels):
+        '''
+        Records the time spent in the with block in the phase_seconds histogram.
+        Works around await statements too.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('phase_seconds', time.perf_counter() - start, phase=phase, **labels)
+
+    def to_dict(self) -> dict:
+        def labelled(items: dict, convert: Callable = lambda v: v) -> list:
+            return [{'name': name, 'labels': dict(labels), 'value': convert(value)}
+                    for (name, labels), value in sorted(items.items(), key=lambda i: (i[0][0], i[0][1]))]
+
+        with self.lock:
+            return {
+                'started': self.started,
+                'updated': time.time(),
+                'counters': labelled(self.counters),
+                'gauges': labelled(self.gauges),
+                'histograms': labelled(self.histograms, lambda h: h.to_dict())
+            }
+
+    def to_prometheus(self) -> str:
+        lines = []
+
+        def header(name: str):
+            kind, help = descriptions[name]
+            lines.append(f'# HELP {prefix}{name} {help}')
+            lines.append(f'# TYPE {prefix}{name} {kind}')
+
+        def format_labels(labels: tuple, extra: str = '') -> str:
+            parts = [f'{k}="{escape(str(v))}"' for k, v in labels]
+            if extra:
+                parts.append(extra)
+            return '{' + ','.join(parts) + '}' if parts else ''
+
+        with self.lock:
+            for name in descriptions:
+                if descriptions[name][0] == 'histogram':
+                    series = {k: v for k, v in self.histograms.items() if k[0] == name}
+                    if series:
+                        header(name)
+                    for (_, labels), h in sorted(series.items()):
+                        for bound, count in zip(buckets + ['+Inf'], h.counts + [h.count]):
+                            le = 'le="' + str(bound) + '"'
+                            lines.append(f'{prefix}{name}_bucket{format_labels(labels, le)} {count}')
+                        lines.append(f'{prefix}{name}_sum{format_labels(labels)} {h.sum}')
+                        lines.append(f'{prefix}{name}_count{format_labels(labels)} {h.count}')
+                else:
+                    source = self.counters if descriptions[name][0] == 'counter' else self.gauges
+                    series = {k: v for k, v in source.items() if k[0] == name}
+                    if series:
+                        header(name)
+                    for (_, labels), value in sorted(series.items()):
+                        lines.append(f'{prefix}{name}{format_labels(labels)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_atomic(path: str, text: str):
+    '''
+    Writes to a temporary file first, so that readers never see a partial file
+    '''
+    tmp = f'{path}.{os.getpid()}.tmp'
+    f = open(tmp, mode='w', encoding='utf-8')
+    f.write(text)
+    f.close()
+    os.replace(tmp, path)
+
+
+# Metrics of the current process
+metrics = Metrics()
+
+
+class Exporter:
+    '''
+    Periodically writes the metrics to a Prometheus textfile and/or a JSON status
+    file. The status callback can add extra information to the JSON file.
+    '''
+
+    def __init__(self, metrics_file: str | None, status_file: str | None, interval: float,
+                 status: Callable[[], dict] | None = None) -> None:
+        self.metrics_file = metrics_file
+        self.status_file = status_file
+        self.interval = interval
+        self.status = status
+        self.stopped = threading.Event()
+
+    def write(self):
+        try:
+            if self.metrics_file:
+                write_atomic(self.metrics_file, metrics.to_prometheus())
+            if self.status_file:
+                status = metrics.to_dict()
+                if self.status:
+                    status['status'] = self.status()
+                write_atomic(self.status_file, json.dumps(status, indent=4))
+        except OSError as e:
+            print(f'Could not write metrics: {e}', file=sys.stderr)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def start(self):
+        threading.Thread(target=self.run, name='a8utils-metrics', daemon=True).start()
+        # Make sure the final values end up on disk, also when the sync loop exits
+        atexit.register(self.stop)
+
+    def stop(self):
+        self.stopped.set()
+        self.write()
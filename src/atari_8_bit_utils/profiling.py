@@ -0,0 +1,90 @@
+from __future__ import annotations
+from collections import Counter
+from collections.abc import Callable
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+
+# Profilers for the --profile option. Each start_* function starts profiling and
+# returns a function that stops it and writes the result.
+
+
+def start_cprofile(path: str) -> Callable[[], None]:
+    '''
+    Deterministic profile of the main thread. Writes pstats data to path, or a
+    summary of the most expensive functions to STDERR if path is "-".
+    '''
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    def stop():
+        profiler.disable()
+        if path == '-':
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(30)
+            print(out.getvalue(), file=sys.stderr)
+        else:
+            profiler.dump_stats(path)
+            print(f'Profile written to {path}', file=sys.stderr)
+
+    return stop
+
+
+class Sampler:
+    '''
+    Samples the stacks of all threads at a fixed interval. The result is written
+    in the folded format used by flamegraph.pl and speedscope, one line per
+    unique stack with the number of samples.
+    '''
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='a8utils-sampler', daemon=True)
+
+    def run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self.stopped.wait(self.interval):
+            names.update({t.ident: t.name for t in threading.enumerate()})
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+
+def start_sampler(path: str, interval: float = 0.005) -> Callable[[], None]:
+    sampler = Sampler(interval)
+    sampler.thread.start()
+
+    def stop():
+        sampler.stopped.set()
+        sampler.thread.join()
+        if path == '-':
+            print(sampler.folded(), file=sys.stderr)
+        else:
+            f = open(path, mode='w', encoding='utf-8')
+            f.write(sampler.folded())
+            f.close()
+            print(f'{sum(sampler.samples.values())} samples written to {path}', file=sys.stderr)
+
+    return stop
+
+
+def start_profile(path: str, mode: str = 'cprofile') -> Callable[[], None]:
+    if mode == 'sample':
+        return start_sampler(path)
+    return start_cprofile(path)
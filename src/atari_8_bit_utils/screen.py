@@ -0,0 +1,186 @@
+from __future__ import annotations
+from collections.abc import Iterable, Iterator
+import difflib
+import os
+from typing import BinaryIO, TextIO
+from .atascii import translate
+
+# Renders screen memory to UTF-8 text. Screen memory holds ANTIC internal
+# character codes, which are ATASCII in a different order: the first three
+# quarters of the character set are rotated, and bit 7 selects inverse video in
+# the same way.
+#
+#     internal 0x00-0x1f -> ATASCII 0x20-0x3f (space, digits, punctuation)
+#     internal 0x20-0x3f -> ATASCII 0x40-0x5f (@, uppercase letters)
+#     internal 0x40-0x5f -> ATASCII 0x00-0x1f (graphics characters)
+#     internal 0x60-0x7f -> ATASCII 0x60-0x7f (lowercase letters)
+
+# ANTIC text modes: columns and rows of a full screen, and the mask that
+# selects the character from a byte. In modes 6 and 7 the top two bits select
+# the color, in modes 4 and 5 bit 7 does, so only mode 2 has inverse video.
+modes = {
+    'gr0': (40, 24, 0xff),   # ANTIC mode 2, GRAPHICS 0
+    'antic4': (40, 24, 0x7f),
+    'antic5': (40, 12, 0x7f),
+    'gr1': (20, 24, 0x3f),   # ANTIC mode 6, GRAPHICS 1
+    'gr2': (20, 12, 0x3f),   # ANTIC mode 7, GRAPHICS 2
+}
+
+ANSI_INVERSE = '\x1b[7m'
+ANSI_NORMAL = '\x1b[27m'
+
+
+def to_atascii(code: int) -> int:
+    '''
+    Converts an ANTIC internal character code to ATASCII
+    '''
+    low = code & 0x7f
+    if low < 0x40:
+        low += 0x20
+    elif low < 0x60:
+        low -= 0x40
+    return low | (code & 0x80)
+
+
+def internal_table(mask: int = 0xff, ansi: bool = False) -> dict[int, str]:
+    '''
+    Table for str.translate that maps internal codes (as Latin-1 characters) to
+    UTF-8 text. Inverse characters use the '`' escape of the ATASCII mapping, or
+    ANSI reverse video if ansi is set.
+    '''
+    table = {}
+    for code in range(0x100):
+        atascii = to_atascii(code & mask)
+        if atascii & 0x80 and ansi:
+            char = ANSI_INVERSE + translate[atascii ^ 0x80] + ANSI_NORMAL
+        elif atascii == 0x9b:
+            # There are no line ends in screen memory, this is an inverse escape
+            char = '`' + translate[0x1b]
+        else:
+            char = translate[atascii]
+        table[code] = char
+    return table
+
+
+class Renderer:
+    '''
+    Renders frames of screen memory, one text line per row. Rows that didn't change
+    since the previous frame aren't rendered again.
+    '''
+
+    def __init__(self, mode: str = 'gr0', columns: int | None = None, rows: int | None = None,
+                 ansi: bool = False) -> None:
+        mode_columns, mode_rows, mask = modes[mode]
+        self.columns = columns or mode_columns
+        self.rows = rows or mode_rows
+        self.table = internal_table(mask, ansi)
+        self.previous: list[bytes] = []
+        self.lines: list[str] = []
+
+    @property
+    def frame_size(self) -> int:
+        return self.columns * self.rows
+
+    def render_row(self, row: bytes) -> str:
+        return row.decode('latin-1').translate(self.table)
+
+    def update(self, frame: bytes) -> list[int]:
+        '''
+        Renders a frame and returns the indexes of the rows that changed
+        '''
+        changed = []
+        for i in range(self.rows):
+            row = frame[i * self.columns:(i + 1) * self.columns]
+            if i < len(self.previous) and self.previous[i] == row:
+                continue
+            if i < len(self.previous):
+                self.previous[i] = row
+                self.lines[i] = self.render_row(row)
+            else:
+                self.previous.append(row)
+                self.lines.append(self.render_row(row))
+            changed.append(i)
+        return changed
+
+    def render(self, frame: bytes) -> str:
+        self.update(frame)
+        return '\n'.join(self.lines) + '\n'
+
+
+def read_frames(f: BinaryIO, size: int) -> Iterator[bytes]:
+    '''
+    Yields consecutive frames of size bytes. A partial frame at the end is ignored.
+    '''
+    while True:
+        frame = f.read(size)
+        while frame and len(frame) < size:
+            # Reads from a pipe can return less than was asked for
+            more = f.read(size - len(frame))
+            if not more:
+                return
+            frame += more
+        if len(frame) < size:
+            return
+        yield frame
+
+
+def watch(f: BinaryIO, out: TextIO, renderer: Renderer):
+    '''
+    Shows a stream of frames on a terminal. Only the rows that changed are redrawn.
+    '''
+    out.write('\x1b[2J')
+    for frame in read_frames(f, renderer.frame_size):
+        for i in renderer.update(frame):
+            out.write(f'\x1b[{i + 1};1H\x1b[2K{renderer.lines[i]}')
+        out.flush()
+    out.write(f'\x1b[{renderer.rows + 1};1H')
+
+
+def frame_files(paths: Iterable[str]) -> list[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if not name.startswith('.') and os.path.isfile(os.path.join(path, name)))
+        else:
+            files.append(path)
+    return files
+
+
+def render_file(path: str, renderer: Renderer) -> list[str]:
+    '''
+    Renders every frame in a capture file
+    '''
+    f = open(path, 'rb')
+    frames = [renderer.render(frame) for frame in read_frames(f, renderer.frame_size)]
+    f.close()
+    return frames
+
+
+def diff_frames(expected: str, actual: str, mode: str = 'gr0', columns: int | None = None,
+                rows: int | None = None) -> Iterator[tuple[str, int, str]]:
+    '''
+    Compares two captures, files or directories of files with the same names. Yields
+    the name, the frame number and a unified diff of every frame that differs.
+    '''
+    if os.path.isdir(expected):
+        names = sorted(set(os.listdir(expected)) | set(os.listdir(actual)))
+        pairs = [(os.path.join(expected, name), os.path.join(actual, name)) for name in names if not name.startswith('.')]
+    else:
+        pairs = [(expected, actual)]
+
+    for left, right in pairs:
+        name = os.path.basename(left)
+        if not (os.path.isfile(left) and os.path.isfile(right)):
+            yield name, -1, f'only in {os.path.dirname(left if os.path.isfile(left) else right)}\n'
+            continue
+        # Each side gets its own renderer, so that unchanged rows are reused within a capture
+        left_frames = render_file(left, Renderer(mode, columns, rows))
+        right_frames = render_file(right, Renderer(mode, columns, rows))
+        for i in range(max(len(left_frames), len(right_frames))):
+            a = left_frames[i] if i < len(left_frames) else ''
+            b = right_frames[i] if i < len(right_frames) else ''
+            if a != b:
+                diff = difflib.unified_diff(a.splitlines(keepends=True), b.splitlines(keepends=True),
+                                            f'{left}#{i}', f'{right}#{i}')
+                yield name, i, ''.join(diff)
@@ -0,0 +1,220 @@
+from __future__ import annotations
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import heapq
+import itertools
+import json
+import os
+import re
+import time
+import traceback
+from .diskimage import image_pattern
+from .sync import Project, controller, default_config, project_class, record_tick, start_control, start_metrics
+
+# Manifest format, e.g. projects.json:
+#
+# {
+#     "jobs": 4,
+#     "projects": [
+#         {"root": "games/frogger"},
+#         {"root": "tools", "atr": "DOS25.atr", "utf8": "tools/src/dos25"}
+#     ]
+# }
+#
+# Each entry accepts the arguments of sync.Project. Entries without an "atr" key
+# are expanded with expand_root().
+
+
+def expand_root(root: str, cls: type[Project] = Project) -> list[Project]:
+    '''
+    Creates one Project per disk image (ATR, XFD, DCM or ATX) in root/atr. A root with zero or one images
+    uses the classic layout. With more than one image, each image gets its own
+    state file (state.IMAGE.json) and its own subdirectory in atascii/ and utf8/.
+    Images that only differ in their extension, e.g. GAME.atr and GAME.dcm, keep
+    the extension in IMAGE.
+    '''
+    atr_dir = os.path.join(root, 'atr')
+    images = []
+    if os.path.isdir(atr_dir):
+        images = sorted(entry.name for entry in os.scandir(atr_dir)
+                        if entry.is_file() and re.search(image_pattern, entry.name))
+
+    if len(images) <= 1:
+        return [cls(root)]
+
+    stems = [os.path.splitext(image)[0] for image in images]
+    projects = []
+    for image in images:
+        stem = os.path.splitext(image)[0]
+        if stems.count(stem) > 1:
+            stem = image
+        projects.append(cls(
+            root,
+            atr=image,
+            state_file=os.path.join(root, f'state.{stem}.json'),
+            atascii=os.path.join(root, 'atascii', stem),
+            utf8=os.path.join(root, 'utf8', stem),
+            name=f'{os.path.basename(os.path.abspath(root))}/{stem}'
+        ))
+    return projects
+
+
+def load_manifest(path: str, cls: type[Project] = Project) -> tuple[list[Project], dict]:
+    '''
+    Loads a manifest file and returns the projects it describes, plus any
+    remaining top level options
+    '''
+    f = open(path, mode='r')
+    manifest = json.loads(f.read())
+    f.close()
+
+    # Paths in the manifest are relative to the manifest itself
+    base = os.path.dirname(os.path.abspath(path))
+    projects = []
+    for entry in manifest.get('projects', []):
+        entry = dict(entry)
+        for key in ['root', 'state_file', 'atascii', 'utf8']:
+            if entry.get(key):
+                entry[key] = os.path.join(base, entry[key])
+        if entry.get('atr'):
+            projects.append(cls(**entry))
+        else:
+            projects.extend(expand_root(entry.get('root', base), cls))
+
+    options = {k: v for k, v in manifest.items() if k != 'projects'}
+    return projects, options
+
+
+class Supervisor:
+    '''
+    Runs the recon loop for many projects in a single process. Ticks are run on a
+    shared thread pool, with at most one tick in flight per project. Projects that
+    are due are scheduled in order of their due time, and projects that still had
+    work to do are put at the back of the queue, so that one busy project can't
+    starve the others.
+    '''
+
+    def __init__(self, projects: list[Project], jobs: int | None = None) -> None:
+        self.projects = projects
+        self.jobs = jobs or min(len(projects), os.cpu_count() or 1) or 1
+        self.executor = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix='a8utils-sync')
+        self.counter = itertools.count()
+        self.queue: list[tuple[float, int, Project]] = []
+        self.in_flight: dict[Future, Project] = {}
+
+        for project in projects:
+            project.supervised = True
+
+    def schedule(self, project: Project):
+        if not project.done:
+            heapq.heappush(self.queue, (project.next_due, next(self.counter), project))
+
+    def run_tick(self, project: Project):
+        started = time.time()
+        start = time.perf_counter()
+        project.tick()
+        record_tick(project, started, time.perf_counter() - start)
+
+    def finished(self, future: Future):
+        project = self.in_flight.pop(future)
+        error = future.exception()
+        now = time.monotonic()
+        if error is not None:
+            project.log(f'Tick failed: {error}')
+            project.log(''.join(traceback.format_exception(type(error), error, error.__traceback__)))
+            project.next_due = now + (project.get_config('delay') or default_config['delay'])
+        elif project.next_due <= now:
+            # The tick did something other than Wait, so go again, but only after
+            # everyone else who is due
+            project.next_due = now
+        self.schedule(project)
+
+    def request_exit(self):
+        for project in self.projects:
+            project.context['exit_now'] = True
+            project.next_due = 0.0
+        self.queue = [(0.0, seq, p) for _, seq, p in self.queue]
+        heapq.heapify(self.queue)
+
+    def run(self):
+        for project in self.projects:
+            self.schedule(project)
+
+        exiting = tick = False
+        try:
+            while self.queue or self.in_flight:
+                try:
+                    controller.wait_if_paused()
+                    if controller.shutdown_requested and not exiting:
+                        exiting = True
+                        self.request_exit()
+                    if controller.tick_requested or tick:
+                        controller.tick_requested = tick = False
+                        self.queue = [(0.0, seq, p) for _, seq, p in self.queue]
+                        heapq.heapify(self.queue)
+
+                    now = time.monotonic()
+                    while self.queue and self.queue[0][0] <= now and len(self.in_flight) < self.jobs:
+                        _, _, project = heapq.heappop(self.queue)
+                        self.in_flight[self.executor.submit(self.run_tick, project)] = project
+
+                    timeout = max(self.queue[0][0] - now, 0) if self.queue else None
+                    if self.in_flight:
+                        controller.state = 'running'
+                        # Wake up regularly to pick up control channel requests. If every
+                        # worker is busy, projects that are due have to wait for a tick to
+                        # finish anyway, so don't let their due time turn this into a busy loop.
+                        poll = 0.25
+                        if timeout is not None and len(self.in_flight) < self.jobs:
+                            poll = min(timeout, poll)
+                        done, _ = wait(list(self.in_flight), timeout=poll, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self.finished(future)
+                    elif timeout:
+                        # sleep() clears the tick request, so keep it for the next round
+                        tick = controller.sleep(timeout) == 'tick'
+                except KeyboardInterrupt:
+                    exiting = True
+                    self.request_exit()
+        finally:
+            self.executor.shutdown(wait=True)
+
+
+def supervise_main(roots: list[str] | None = None, manifest: str | None = None, reset: bool = False,
+                   once: bool = None, daemon: bool = None, control_port: int = None, jobs: int = None,
+                   engine: str = 'serial', overrides: dict | None = None, metrics_file: str | None = None,
+                   status_file: str | None = None):
+    cls = project_class(engine)
+    projects = []
+    options = {}
+    if manifest:
+        projects, options = load_manifest(manifest, cls)
+    for root in roots or []:
+        projects.extend(expand_root(root, cls))
+
+    if not projects:
+        print('No projects to supervise')
+        return
+
+    if engine == 'asyncio':
+        from .aio import shared_executor
+        for project in projects:
+            project.executor = shared_executor()
+
+    for project in projects:
+        project.context |= overrides or {}
+        project.init(reset)
+        if once:
+            project.context['max_iterations'] = 1
+        elif daemon:
+            project.context['max_iterations'] = 0
+        project.build_tree()
+
+    if control_port is None:
+        control_port = options.get('control_port', 0)
+    start_control(projects[0], control_port)
+    start_metrics(projects[0], metrics_file or options.get('metrics_file'), status_file or options.get('status_file'))
+
+    print(f'Supervising {len(projects)} project(s)')
+    for project in projects:
+        print(f'\t{project.name}: {project.atr_dir} -> {project.atascii_dir}, {project.utf8_dir}')
+    Supervisor(projects, jobs or options.get('jobs')).run()
@@ -1,37 +1,32 @@
 from __future__ import annotations
 from collections.abc import Callable
 import os
-import hashlib
 import os.path
-import re
 import json
 import subprocess
 import textwrap
 import sys
+import threading
 import time
 from .atascii import clear_dir
 from .atascii import files_to_utf8
+from .cache import Cache, open_cache
 from .behavior import ALWAYS, NEVER, Behavior, BehaviorTree, Result
+from .control import Controller, install_signal_handlers, start_server
+from .diskimage import ImageError, extract_image, image_pattern, is_atr
+from .filestate import Changeset, DirState, diff, scan
+from .metrics import Exporter, metrics
 from .tree import atr_tree
 
 state_file = './state.json'
 
 # Global variables
-tree = BehaviorTree()
-# The global state & config variables are not kept up to date automatically, so they
-# should be refreshed before use.
-current_config: dict | None = None
-stored_state: dict | None = None
-current_state: dict | None = None
-
-# Config object holding two categories of information:
-# 1. Any settings that were overridden for the current run. These config values will
-#    be used in the program logic, but will not be persisted.
-# 2. Global state variables that we use from multiple places
-current_context = {
-    'exit_now': False,
-    'iterations': 0
-}
+controller = Controller()
+
+# Projects with the same root share a git repository, and git can only add to or
+# commit from its index in one place at a time. One lock per absolute root path.
+git_locks: dict[str, threading.Lock] = {}
+git_locks_guard = threading.Lock()
 
 default_config = {
     'delay': 30,             # Time delay in seconds between executions of the recon loop
@@ -43,247 +38,433 @@ default_config = {
     'max_iterations': 0,
 
     # Flag indicating whether we should commit every time one or more files change.
-    'auto_commit': False
+    'auto_commit': False,
+
+    # Port on 127.0.0.1 for the control channel (tick/pause/resume/status/shutdown).
+    # A value of 0 disables the control channel.
+    'control_port': 0,
+
+    # Directory of the content addressed cache of converted files, shared with the
+    # ata2utf and utf2ata commands. None disables the cache.
+    'cache_dir': None,
+    # Maximum size of the cache in bytes. None uses the cache's default
+    'cache_size': None,
+
+    # Write tokenized BASIC programs as listings (NAME.BAS.LST) instead of
+    # converting them byte by byte
+    'detokenize': False,
+
+    # Files the sync metrics are written to every metrics_interval seconds: a
+    # Prometheus textfile and a JSON status file. None disables either one.
+    'metrics_file': None,
+    'status_file': None,
+    'metrics_interval': 15
 }
 
+# The keys of the state dict, in the order in which they are computed
+state_keys = ['config', 'atr', 'atascii', 'utf8', 'commit']
+# The keys whose value is the DirState of a directory
+dir_keys = ['atr', 'atascii', 'utf8']
 
-def apply_default_config():
-    global current_config
-    print('No config found in state.json. Using defaults')
-    current_config = default_config
-    print(textwrap.indent(json.dumps(current_config, indent=4), '\t'))
-    print('\tWith overrides:')
-    print(textwrap.indent(json.dumps(current_context, indent=4), '\t  '))
-    return Result.SUCCESS
 
+def git_lock(root: str) -> threading.Lock:
+    with git_locks_guard:
+        return git_locks.setdefault(os.path.abspath(root), threading.Lock())
 
-def get_config(key: str):
+
+class Project:
     '''
-    Get's the effective config value for the given key. This function
-    should only be used in the main business logic and not in any code
-    related to loading, saving or defaulting config values in
-    in state.json
+    A single ATR image together with the state file and the ATASCII and UTF-8
+    directories it is kept in sync with. With the default arguments this is the
+    classic atr2git layout in the current working directory, i.e. ./state.json,
+    ./atr, ./atascii and ./utf8.
     '''
-    config_val = None
-
-    override = current_context.get(key)
-    # print(f'\t\tOverride value: {override}')
-
-    if not current_config:
-        config_val = None
-    elif not current_context.get(key) is None:
-        config_val = override
-    else:
-        config_val = current_config.get(key)
-
-    # print(f'\tget_config({key}) --> {config_val}')
-    return config_val
-
-
-def load_state():
-    f = open(state_file, mode='r')
-    state = json.loads(f.read())
-    f.close()
-    return state
-
-
-def apply_config():
-    global current_config
-
-    # Merge defaults with values loaded from file
-    current_config = default_config | load_state()['config']
-    print('Using config:')
-    print(textwrap.indent(json.dumps(current_config, indent=4), '\t  '))
-    print('\tWith overrides:')
-    print(textwrap.indent(json.dumps(current_context, indent=4), '\t  '))
-    return Result.SUCCESS
-
-
-def wait():
-    delay = get_config('delay')
-    print(f'Sleeping for {delay} seconds')
-    time.sleep(delay)
-    return Result.SUCCESS
-
-
-def extract_atr():
-    clear_dir('./atascii')
-    atr_file = get_current_state()['atr'][0]['name']
-    subprocess.run(f'lsatr -X ./atascii ./atr/{atr_file}')
-    return Result.SUCCESS
 
+    def __init__(self, root: str = '.', atr: str | None = None, state_file: str | None = None,
+                 atascii: str | None = None, utf8: str | None = None, name: str | None = None) -> None:
+        self.root = root
+        # Name of the image in ./atr to sync. If None, the first image is used.
+        self.atr = atr
+        self.atr_dir = os.path.join(root, 'atr')
+        self.state_file = state_file or os.path.join(root, 'state.json')
+        self.atascii_dir = atascii or os.path.join(root, 'atascii')
+        self.utf8_dir = utf8 or os.path.join(root, 'utf8')
+        self.name = name or atr or os.path.basename(os.path.abspath(root))
+
+        # The state & config variables are not kept up to date automatically, so they
+        # should be refreshed before use.
+        self.current_config: dict | None = None
+        self.stored_state: dict | None = None
+        self.current_state: dict | None = None
+        # The last scan of each directory, to reuse the checksums of unchanged files
+        self.scanned: dict[str, DirState] = {}
+
+        # Config object holding two categories of information:
+        # 1. Any settings that were overridden for the current run. These config values will
+        #    be used in the program logic, but will not be persisted.
+        # 2. State variables that we use from multiple places
+        self.context = {
+            'exit_now': False,
+            'iterations': 0
+        }
 
-def delete_utf8():
-    clear_dir('./utf8')
-    return Result.SUCCESS
+        # Set when the project is run by a Supervisor rather than by recon_loop()
+        self.supervised = False
+        self.done = False
+        self.next_due = 0.0
+        self.tree = BehaviorTree()
+
+    def log(self, msg: str = '', **kwds):
+        if self.supervised:
+            msg = textwrap.indent(msg, f'[{self.name}] ') if msg else f'[{self.name}]'
+        print(msg, **kwds)
+
+    def apply_default_config(self):
+        self.log('No config found in state.json. Using defaults')
+        self.current_config = default_config
+        self.log(textwrap.indent(json.dumps(self.current_config, indent=4), '\t'))
+        self.log('\tWith overrides:')
+        self.log(textwrap.indent(json.dumps(self.context, indent=4), '\t  '))
+        return Result.SUCCESS
 
+    def get_config(self, key: str):
+        '''
+        Get's the effective config value for the given key. This function
+        should only be used in the main business logic and not in any code
+        related to loading, saving or defaulting config values in
+        in state.json
+        '''
+        config_val = None
 
-def write_utf8():
-    files_to_utf8('./atascii', './utf8')
-    return Result.SUCCESS
+        override = self.context.get(key)
 
+        if not self.current_config:
+            config_val = None
+        elif not self.context.get(key) is None:
+            config_val = override
+        else:
+            config_val = self.current_config.get(key)
 
-def commit():
-    subprocess.run('git add ./utf8')
-    subprocess.run('git add ./atascii')
-    subprocess.run('git commit -F ./utf8/COMMIT.MSG')
-    return Result.SUCCESS
+        return config_val
 
+    def load_state(self):
+        f = open(self.state_file, mode='r')
+        state = json.loads(f.read())
+        f.close()
+        for key in dir_keys:
+            if key in state:
+                state[key] = DirState.from_json(state[key])
+        return state
+
+    def save_state(self, state):
+        f = open(self.state_file, mode='w')
+        f.write(json.dumps(state, indent=4, default=lambda value: value.to_json()))
+        f.close()
 
-def update_state(key, previous: Result = Result.SUCCESS) -> Result:
-    if previous != Result.SUCCESS:
-        print(f'\nSkipping state up since step returned {previous}')
-        return previous
+    def apply_config(self):
+        # Merge defaults with values loaded from file
+        self.current_config = default_config | self.load_state()['config']
+        self.log('Using config:')
+        self.log(textwrap.indent(json.dumps(self.current_config, indent=4), '\t  '))
+        self.log('\tWith overrides:')
+        self.log(textwrap.indent(json.dumps(self.context, indent=4), '\t  '))
+        return Result.SUCCESS
 
-    stored_state = load_state()
-    current_state = get_current_state()
+    def wait(self):
+        delay = self.get_config('delay')
+        if self.supervised:
+            # The supervisor does the waiting, we only tell it when we're due again
+            self.next_due = time.monotonic() + delay
+            return Result.SUCCESS
 
-    print(f'\tUpdating state[{key}]')
-    stored_state[key] = current_state[key]
-    save_state(stored_state)
-    return Result.SUCCESS
+        print(f'Sleeping for {delay} seconds')
+        if controller.sleep(delay):
+            print('\tWoken up by control channel')
+        return Result.SUCCESS
 
+    def quit(self):
+        if self.supervised:
+            self.log('\tExiting sync process')
+            self.done = True
+            return Result.SUCCESS
+        sys.exit('\tExiting sync process')
+
+    def extract_atr(self):
+        with metrics.timer('extract', project=self.name):
+            clear_dir(self.atascii_dir)
+            atr_file = self.get_state('atr')[0].name
+            if is_atr(atr_file):
+                subprocess.run(['lsatr', '-X', self.atascii_dir, self.atr_path(atr_file)])
+            else:
+                try:
+                    extract_image(self.atr_path(atr_file), self.atascii_dir)
+                except ImageError as e:
+                    # Probably still being written, try again on the next tick
+                    return self.fail(f'\tCould not read {atr_file}: {e}')
+        return Result.SUCCESS
 
-def update(key: str, action: Callable[[], Result]) -> Callable[[], Result]:
-    return lambda: update_state(key, action())
+    def delete_utf8(self):
+        stale = self.stale_utf8()
+        self.log(f'Deleting {len(stale)} changed files in {self.utf8_dir}')
+        for path in stale:
+            os.remove(path)
+        return Result.SUCCESS
 
+    def write_utf8(self):
+        cache = self.get_cache()
+        pending = self.pending_utf8() if self.current_state['utf8'] else None
+        start = time.perf_counter()
+        with metrics.timer('convert', project=self.name):
+            files_to_utf8(self.atascii_dir, self.utf8_dir, cache=cache, detokenize=bool(self.get_config('detokenize')),
+                          names=pending)
+        self.record_conversion(time.perf_counter() - start, pending)
+        self.log_cache(cache)
+        return Result.SUCCESS
 
-def fail(msg: str) -> Result:
-    print(msg)
-    return Result.FAILURE
+    def outputs(self, name: str) -> list[str]:
+        '''
+        Names of the files in the UTF-8 directory that can be written for an ATASCII file
+        '''
+        if self.get_config('detokenize') and name.upper().endswith('.BAS'):
+            return [name, name + '.LST']
+        return [name]
+
+    def stale_utf8(self) -> list[str]:
+        '''
+        Paths of the outputs of ATASCII files that were removed or modified since the last sync
+        '''
+        changes = self.changes('atascii')
+        paths = []
+        for name in changes.removed + changes.modified:
+            for output in self.outputs(name):
+                path = os.path.join(self.utf8_dir, output)
+                if os.path.isfile(path):
+                    paths.append(path)
+        return paths
+
+    def pending_utf8(self) -> list[str]:
+        '''
+        Names of the ATASCII files that don't have an output in the UTF-8 directory
+        '''
+        written = set(self.current_state['utf8'].names())
+        return [name for name in self.current_state['atascii'].names()
+                if not any(output in written for output in self.outputs(name))]
+
+    def record_conversion(self, duration: float, names: list[str] | None = None):
+        if names is None:
+            names = [entry.name for entry in os.scandir(self.atascii_dir) if entry.is_file()]
+        size = sum(os.path.getsize(os.path.join(self.atascii_dir, name)) for name in names)
+        metrics.inc('converted_bytes_total', size, project=self.name)
+        if duration > 0:
+            metrics.set('conversion_bytes_per_second', size / duration, project=self.name)
+
+    def get_cache(self) -> Cache | None:
+        cache_dir = self.get_config('cache_dir')
+        if not cache_dir:
+            return None
+        return open_cache(cache_dir, self.get_config('cache_size'))
+
+    def log_cache(self, cache: Cache | None):
+        if cache:
+            self.log(f'\tCache: {cache.hits} hits, {cache.misses} misses')
+
+    def commit(self):
+        root, utf8, atascii, msg = self.commit_paths()
+        with git_lock(root), metrics.timer('git', project=self.name):
+            subprocess.run(['git', '-C', root, 'add', utf8])
+            subprocess.run(['git', '-C', root, 'add', atascii])
+            # Only commit our own directories, not whatever else is in the index
+            subprocess.run(['git', '-C', root, 'commit', '-F', msg, '--', utf8, atascii])
+        return Result.SUCCESS
 
+    def atr_path(self, atr_file: str) -> str:
+        return os.path.join(self.atr_dir, atr_file)
 
-def success(msg: str) -> Result:
-    print(msg)
-    return Result.SUCCESS
+    def commit_paths(self) -> tuple[str, str, str, str]:
+        '''
+        Absolute paths of the git root, the two output directories and the commit message
+        '''
+        return (os.path.abspath(self.root), os.path.abspath(self.utf8_dir), os.path.abspath(self.atascii_dir),
+                os.path.abspath(os.path.join(self.utf8_dir, 'COMMIT.MSG')))
 
+    def update_state(self, key, previous: Result = Result.SUCCESS) -> Result:
+        if previous != Result.SUCCESS:
+            self.log(f'\nSkipping state up since step returned {previous}')
+            return previous
 
-def iterate():
-    current_context['iterations'] += 1
+        stored_state = self.load_state()
 
-    if get_config('max_iterations') > 0 and get_config('iterations') >= get_config('max_iterations'):
-        current_context['exit_now'] = True
+        self.log(f'\tUpdating state[{key}]')
+        stored_state[key] = self.get_state(key)
+        self.save_state(stored_state)
         return Result.SUCCESS
 
-    return Result.FAILURE
+    def update(self, key: str, action: Callable[[], Result]) -> Callable[[], Result]:
+        return lambda: self.update_state(key, action())
 
+    def fail(self, msg: str) -> Result:
+        self.log(msg)
+        return Result.FAILURE
 
-predicates: dict[str, Callable[[], bool]] = {
-    'FatalError': lambda: get_config('error'),
-    'ForceQuit': lambda: get_config('exit_now'),
-    'DefaultConfig': lambda: stored_state.get('config') is None,
-    'ApplyConfig': lambda: stored_state['config'] and (not current_config or current_config != stored_state['config']),
-    'ExtractATR': lambda: (not stored_state['atr']) or (current_state['atr'][0] != stored_state['atr'][0]) or not current_state['atascii'],
-    'DeleteUTF8': lambda: (stored_state['atascii'] != current_state['atascii']),
-    'AutoCommit': lambda: get_config('auto_commit'),
-    'WriteUTF8': lambda: not current_state['utf8'],
-    'ConditionalCommit': lambda: current_state.get('commit') and (not stored_state.get('commit') or stored_state['commit'] != current_state['commit'])
-}
-
-
-actions: dict[str, Callable[[], Result]] = {
-    'FatalError': lambda: sys.exit('FATAL ERROR: ', get_config('error')),
-    'ForceQuit': lambda: sys.exit('\tExiting sync process'),
-    'DefaultConfig': update('config', apply_default_config),
-    'ApplyConfig': update('config', apply_config),
-    'ExtractATR': update('atr', extract_atr),
-    'DeleteUTF8': update('atascii', delete_utf8),
-    'WriteUTF8': update('utf8', write_utf8),
-    'PreCommit': lambda: success('PreCommit not yet implemented'),
-    'Commit': update('commit', commit),
-    'PostCommit': lambda: success('PostCommit not yet implemented'),
-    'Iterate': iterate,
-    'Wait': wait
-}
-
+    def success(self, msg: str) -> Result:
+        self.log(msg)
+        return Result.SUCCESS
 
-def md5checksum(file):
-    f = open(file, 'rb')
-    checksum = hashlib.md5(f.read()).hexdigest()
-    f.close()
-    return checksum
-
-
-def scandir(path, output, pattern='.*'):
-    dir = os.scandir(path)
-    with dir:
-        for entry in dir:
-            if not entry.name.startswith('.') and entry.is_file() and not re.search(pattern, entry.name) is None:
-                checksum = md5checksum(entry.path)
-                output.append({
-                    'name': entry.name,
-                    'checksum': checksum
-                })
-    dir.close()
-    output.sort(key=lambda x: x['name'])
-
-
-def get_current_state():
-    state = {
-        'config': current_config,
-        'atr': list(),
-        'atascii': list(),
-        'utf8': list()
-    }
-
-    # ATR
-    scandir('./atr', state['atr'], '\\.atr$')
-
-    # ATASCII
-    scandir('./atascii', state['atascii'])
-
-    # UTF-8
-    scandir('./utf8', state['utf8'])
-
-    # COMMIT MSG
-    commit = './utf8/COMMIT.MSG'
-    if os.path.isfile(commit):
-        f = open(commit, encoding='utf-8')
-        msg = f.read()
-        f.close()
-        state['commit'] = {
-            'msg': msg
+    def iterate(self):
+        self.context['iterations'] += 1
+
+        if self.get_config('max_iterations') > 0 and self.get_config('iterations') >= self.get_config('max_iterations'):
+            self.context['exit_now'] = True
+            return Result.SUCCESS
+
+        return Result.FAILURE
+
+    def predicates(self) -> dict[str, Callable[[], bool]]:
+        return {
+            'FatalError': lambda: self.get_config('error'),
+            'ForceQuit': lambda: self.get_config('exit_now'),
+            'DefaultConfig': lambda: self.stored_state.get('config') is None,
+            'ApplyConfig': lambda: self.stored_state['config'] and (not self.current_config or self.current_config != self.stored_state['config']),
+            'ExtractATR': lambda: (not self.stored_state['atr']) or (self.current_state['atr'][0] != self.stored_state['atr'][0]) or not self.current_state['atascii'],
+            'DeleteUTF8': lambda: bool(self.changes('atascii')),
+            'AutoCommit': lambda: self.get_config('auto_commit'),
+            'WriteUTF8': lambda: not self.current_state['utf8'] or bool(self.pending_utf8()) or bool(self.changes('utf8').removed),
+            'ConditionalCommit': lambda: self.current_state.get('commit') and (not self.stored_state.get('commit') or self.stored_state['commit'] != self.current_state['commit'])
         }
 
-    return state
-
-
-def save_state(state):
-    f = open(state_file, mode='w')
-    f.write(json.dumps(state, indent=4))
-    f.close()
-
-
-# Runs a single iteration of the reconciliation logic
-def recon_tick():
-    global stored_state
-    global current_state
-
-    stored_state = load_state()
-    current_state = get_current_state()
-
-    max_iterations = get_config('max_iterations')
-
-    if max_iterations is None:
-        max_iterations = '?'
-    elif max_iterations <= 0:
-        max_iterations = '∞'
+    def actions(self) -> dict[str, Callable[[], Result]]:
+        return {
+            'FatalError': lambda: sys.exit('FATAL ERROR: ', self.get_config('error')),
+            'ForceQuit': self.quit,
+            'DefaultConfig': self.update('config', self.apply_default_config),
+            'ApplyConfig': self.update('config', self.apply_config),
+            'ExtractATR': self.update('atr', self.extract_atr),
+            'DeleteUTF8': self.update('atascii', self.delete_utf8),
+            'WriteUTF8': self.update('utf8', self.write_utf8),
+            'PreCommit': lambda: self.success('PreCommit not yet implemented'),
+            'Commit': self.update('commit', self.commit),
+            'PostCommit': lambda: self.success('PostCommit not yet implemented'),
+            'Iterate': self.iterate,
+            'Wait': self.wait
+        }
 
-    iterations = current_context['iterations']
-    print(f'({iterations}/{max_iterations}) - ', end='')
-    tree.tick()
+    def get_state(self, key: str):
+        '''
+        Computes the current value of a single key of the state
+        '''
+        if key == 'config':
+            return self.current_config
+
+        if key == 'atr':
+            atr = self.scan(key, self.atr_dir, image_pattern)
+            if self.atr:
+                atr = atr.filter(self.atr)
+            return atr
+
+        if key == 'atascii':
+            return self.scan(key, self.atascii_dir)
+
+        if key == 'utf8':
+            return self.scan(key, self.utf8_dir)
+
+        if key == 'commit':
+            commit = os.path.join(self.utf8_dir, 'COMMIT.MSG')
+            if os.path.isfile(commit):
+                f = open(commit, encoding='utf-8')
+                msg = f.read()
+                f.close()
+                return {
+                    'msg': msg
+                }
+            return None
+
+        raise KeyError(key)
+
+    def scan(self, key: str, path: str, pattern: str = '.*') -> DirState:
+        state, hashed = scan(path, pattern, self.scanned.get(key))
+        self.scanned[key] = state
+        metrics.inc('hash_bytes_total', hashed, project=self.name)
+        return state
+
+    def changes(self, key: str) -> Changeset:
+        '''
+        The files that changed between the stored and the current state of key
+        '''
+        return diff(self.stored_state.get(key), self.current_state.get(key))
+
+    def get_current_state(self):
+        state = {}
+        with metrics.timer('scan', project=self.name):
+            for key in state_keys:
+                state[key] = self.get_state(key)
+
+        # COMMIT MSG
+        if state['commit'] is None:
+            del state['commit']
+
+        return state
+
+    def tick(self) -> Result:
+        '''
+        Runs a single iteration of the reconciliation logic
+        '''
+        self.stored_state = self.load_state()
+        self.current_state = self.get_current_state()
+        self.log_iteration()
+        return self.tree.tick()
+
+    def log_iteration(self):
+        max_iterations = self.get_config('max_iterations')
+
+        if max_iterations is None:
+            max_iterations = '?'
+        elif max_iterations <= 0:
+            max_iterations = '∞'
+
+        iterations = self.context['iterations']
+        self.log(f'({iterations}/{max_iterations}) - ', end='' if not self.supervised else '\n')
+
+    def build_tree(self):
+        root = createBehavior(atr_tree, self.tree, self.actions(), self.predicates())
+
+        self.tree.set_root(root)
+
+    def init(self, clobber=False):
+        for path in [self.atascii_dir, self.utf8_dir]:
+            os.makedirs(path, exist_ok=True)
+
+        if clobber or not os.path.isfile(self.state_file):
+            state = self.get_current_state()
+            self.save_state(state)
+        else:
+            self.log(f'Skipping initialization. State file "{self.state_file}" already exists')
 
 
-def recon_loop():
+def recon_loop(project: Project):
     while True:
         try:
-            recon_tick()
+            controller.wait_if_paused()
+            if controller.shutdown_requested:
+                project.context['exit_now'] = True
+            controller.state = 'running'
+            started = time.time()
+            start = time.perf_counter()
+            project.tick()
+            record_tick(project, started, time.perf_counter() - start)
         except KeyboardInterrupt:
-            current_context['iterations'] += 1
-            current_context['exit_now'] = True
+            project.context['iterations'] += 1
+            project.context['exit_now'] = True
+
+
+def record_tick(project: Project, started: float, duration: float):
+    controller.record_tick(started, duration, project.context['iterations'], project.name if project.supervised else None)
+    metrics.observe('phase_seconds', duration, phase='tick', project=project.name)
+    metrics.inc('ticks_total', project=project.name)
+    metrics.set('last_tick_timestamp_seconds', time.time(), project=project.name)
 
 
-def createBehavior(item: str | dict) -> Behavior:
+def createBehavior(item: str | dict, tree: BehaviorTree, actions: dict[str, Callable[[], Result]],
+                   predicates: dict[str, Callable[[], bool]]) -> Behavior:
     if isinstance(item, str):
         action = actions.get(item)
         if not action:
@@ -295,7 +476,7 @@ def createBehavior(item: str | dict) -> Behavior:
     if isinstance(item, dict):
         if item.get('ref'):
             return tree.behaviors.get(item['ref'])
-        children = list(map(lambda c: createBehavior(c), item['children']))
+        children = list(map(lambda c: createBehavior(c, tree, actions, predicates), item['children']))
         name = item['name']
         predicate = predicates.get(name, ALWAYS)
         if item['type'] == 'Sequence':
@@ -308,32 +489,65 @@ def createBehavior(item: str | dict) -> Behavior:
         return f'Error: {type(item)} {item}'
 
 
-def build_tree():
-    root = createBehavior(atr_tree)
+def start_control(project: Project, port: int | None = None):
+    '''
+    Starts the control channel if a port was given on the command line or
+    configured in state.json, and installs the signal based fallback.
+    '''
+    if port is None:
+        port = (project.load_state().get('config') or {}).get('control_port', 0)
+    if port:
+        start_server(controller, port)
+    install_signal_handlers(controller)
 
-    tree.set_root(root)
 
+def start_metrics(project: Project, metrics_file: str | None = None, status_file: str | None = None):
+    '''
+    Starts writing the metrics files given on the command line or configured in
+    state.json
+    '''
+    config = default_config | (project.load_state().get('config') or {})
+    metrics_file = metrics_file or config.get('metrics_file')
+    status_file = status_file or config.get('status_file')
+    if metrics_file or status_file:
+        Exporter(metrics_file, status_file, config.get('metrics_interval'), controller.status).start()
 
-def init(clobber=False):
 
-    if clobber or not os.path.isfile(state_file):
-        state = get_current_state()
-        save_state(state)
-    else:
-        print(f'Skipping initialization. State file "{state_file}" already exists')
+def project_class(engine: str = 'serial') -> type[Project]:
+    '''
+    Returns the Project implementation for the given engine name
+    '''
+    if engine == 'asyncio':
+        from .aio import AsyncProject
+        return AsyncProject
+    return Project
 
 
-def sync_main(reset: bool = False, once: bool = None, daemon: bool = None):
+def sync_main(reset: bool = False, once: bool = None, daemon: bool = None, control_port: int = None,
+              engine: str = 'serial', overrides: dict | None = None, metrics_file: str | None = None,
+              status_file: str | None = None):
 
-    init(reset)
+    if engine == 'asyncio':
+        from .aio import AsyncProject, shared_executor
+        project = AsyncProject(state_file=state_file, executor=shared_executor())
+    else:
+        project = Project(state_file=state_file)
+    project.context |= overrides or {}
+    project.init(reset)
 
     if once:
-        current_context['max_iterations'] = 1
+        project.context['max_iterations'] = 1
     elif daemon:
-        current_context['max_iterations'] = 0
-
-    build_tree()
-    recon_loop()
+        project.context['max_iterations'] = 0
+
+    start_control(project, control_port)
+    start_metrics(project, metrics_file, status_file)
+    project.build_tree()
+    if engine == 'asyncio':
+        from .aio import recon_loop as async_recon_loop
+        async_recon_loop(project)
+    else:
+        recon_loop(project)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,97 @@
+from __future__ import annotations
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+import os
+import re
+import sys
+from .atascii import inv_translate
+
+# Preflight check of UTF-8 input for to_atascii. Finds every character that has
+# no ATASCII representation, without writing any output.
+
+# Characters that map to an ATASCII byte on their own, and characters that can
+# follow a '`' escape
+singles = ''.join(sorted(k for k in inv_translate if len(k) == 1))
+escapable = ''.join(sorted(k[1] for k in inv_translate if len(k) == 2 and k[0] == '`'))
+
+# Matches a character that isn't encodable, or a '`' that isn't followed by a
+# character that can be escaped. Invalid UTF-8 bytes are decoded as surrogates,
+# which are never encodable.
+invalid = re.compile(f'`(?![{re.escape(escapable)}])|[^{re.escape(singles)}`]')
+
+# Number of files handed to a worker at a time
+chunksize = 16
+
+
+def describe(char: str) -> str:
+    if char == '`':
+        return 'unterminated "`" escape'
+    if '\udc80' <= char <= '\udcff':
+        return f'invalid UTF-8 byte 0x{ord(char) - 0xdc00:02x}'
+    return f'character {char!r} (U+{ord(char):04X}) has no ATASCII representation'
+
+
+def check_text(text: str) -> Iterator[tuple[int, int, str]]:
+    '''
+    Yields the line, column and a description of every problem in text. Lines and
+    columns start at 1.
+    '''
+    line, line_start, counted = 1, 0, 0
+    for match in invalid.finditer(text):
+        position = match.start()
+        # Count newlines incrementally, so that the whole check stays linear
+        newlines = text.count('\n', counted, position)
+        if newlines:
+            line += newlines
+            line_start = text.rindex('\n', counted, position) + 1
+        counted = position
+        yield line, position - line_start + 1, describe(match.group())
+
+
+def check_file(path: str) -> list[tuple[str, int, int, str]]:
+    '''
+    Returns the path, line, column and a description of every problem in a file
+    '''
+    try:
+        # Read the same way as to_atascii, i.e. with universal newlines
+        if path == '-':
+            text = sys.stdin.read()
+        else:
+            f = open(path, 'r', encoding='utf-8', errors='surrogateescape')
+            text = f.read()
+            f.close()
+    except OSError as e:
+        return [(path, 0, 0, str(e))]
+    return [(path, line, column, message) for line, column, message in check_text(text)]
+
+
+def input_files(paths: Iterable[str]) -> Iterator[str]:
+    '''
+    Expands directories to the files converted by files_to_atascii
+    '''
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for filename in sorted(files):
+                if not filename.startswith('.'):
+                    yield os.path.join(root, filename)
+
+
+def check_files(paths: Iterable[str], jobs: int | None = None) -> Iterator[tuple[str, int, int, str]]:
+    '''
+    Checks all files and directories in paths, in parallel. Problems are yielded
+    per file, in the order of the files.
+    '''
+    files = list(input_files(paths))
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(files) <= 1 or '-' in files:
+        for path in files:
+            yield from check_file(path)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(files))) as executor:
+        for problems in executor.map(check_file, files, chunksize=chunksize):
+            yield from problems
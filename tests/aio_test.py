@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import shutil
+import threading
+import unittest
+from unittest import mock
+
+from atari_8_bit_utils.aio import AsyncProject, shared_executor
+from atari_8_bit_utils.diskimage import extract_image
+from atari_8_bit_utils.supervisor import supervise_main
+from atari_8_bit_utils.sync import Project
+
+from .diskimage_test import atr, dos_disk, raw_sectors
+
+
+class TestAsyncProject(unittest.TestCase):
+
+    files = {
+        'HELLO.TXT': b'HELLO WORLD\x9b',
+        'LONG.DAT': bytes(range(256)) * 2,
+        'FILL.DAT': b'\x55' * 123 + b'END'
+    }
+
+    def setUp(self):
+        self.out_path = 'testdata/out/aio/'
+        shutil.rmtree(self.out_path, ignore_errors=True)
+        self.commands = {'serial': [], 'async': []}
+        return super().setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out_path, ignore_errors=True)
+        return super().tearDown()
+
+    def create(self, cls: type, name: str) -> Project:
+        root = self.out_path + name
+        os.makedirs(root + '/atr')
+        with open(root + '/atr/DISK.atr', 'wb') as f:
+            f.write(atr(dos_disk(self.files)))
+        project = cls(root, name=name)
+        project.supervised = True
+        project.context['max_iterations'] = 1
+        project.context['auto_commit'] = True
+        project.init()
+        with open(os.path.join(project.utf8_dir, 'COMMIT.MSG'), 'w', encoding='utf-8') as f:
+            f.write('Sync DISK.atr\n')
+        project.build_tree()
+        return project
+
+    def run_command(self, name: str, args: list) -> int:
+        '''
+        Stands in for lsatr and git. lsatr is replaced by the built in extractor,
+        which reads the same DOS 2 images.
+        '''
+        self.commands[name].append(args[0] if args[0] == 'lsatr' else ' '.join(args[:1] + args[3:4]))
+        if args[0] == 'lsatr':
+            extract_image(args[3], args[2])
+        return 0
+
+    def load(self, project: Project) -> dict:
+        with open(project.state_file) as f:
+            return json.load(f)
+
+    def test_tick_async_matches_serial(self):
+        serial = self.create(Project, 'serial')
+        with mock.patch('atari_8_bit_utils.sync.subprocess.run', side_effect=lambda args: self.run_command('serial', args)):
+            for _ in range(20):
+                if serial.done:
+                    break
+                serial.tick()
+
+        project = self.create(AsyncProject, 'async')
+
+        async def run_process(*args):
+            await asyncio.sleep(0)
+            return self.run_command('async', list(args))
+
+        project.run_process = run_process
+        for _ in range(20):
+            if project.done:
+                break
+            asyncio.run(project.tick_async())
+
+        self.assertTrue(serial.done)
+        self.assertTrue(project.done)
+        self.assertEqual(self.load(project), self.load(serial))
+        self.assertEqual(sorted(os.listdir(project.utf8_dir)), sorted(os.listdir(serial.utf8_dir)))
+        self.assertIn('lsatr', self.commands['async'])
+        self.assertIn('git commit', self.commands['async'])
+        self.assertEqual(set(self.commands['async']), set(self.commands['serial']))
+
+    def test_supervised_projects_share_executor(self):
+        root = self.out_path + 'supervised'
+        os.makedirs(root + '/atr')
+        for name in ['ONE.xfd', 'TWO.xfd']:
+            with open(f'{root}/atr/{name}', 'wb') as f:
+                f.write(raw_sectors(dos_disk(self.files), 128))
+
+        with mock.patch('atari_8_bit_utils.supervisor.Supervisor.run', autospec=True) as run:
+            supervise_main([root], once=True, engine='asyncio')
+        projects = run.call_args[0][0].projects
+        self.assertEqual([project.executor for project in projects], [shared_executor()] * 2)
+
+        # Ticks run on a worker thread, like under the Supervisor
+        def tick():
+            for project in projects:
+                for _ in range(20):
+                    if project.done:
+                        break
+                    project.tick()
+
+        threads = set()
+        get_state = Project.get_state
+
+        def record(project, key):
+            threads.add(threading.current_thread().name.split('_')[0])
+            return get_state(project, key)
+
+        with mock.patch.object(Project, 'get_state', record):
+            thread = threading.Thread(target=tick)
+            thread.start()
+            thread.join()
+        self.assertTrue(all(project.done for project in projects))
+        self.assertEqual(sorted(os.listdir(projects[1].atascii_dir)), sorted(self.files))
+        # All hashing ran on the shared pool, not on a default executor per tick
+        self.assertEqual(threads, {'a8utils-io'})
+
+
+if __name__ == '__main__':
+    unittest.main()
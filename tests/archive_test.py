@@ -0,0 +1,104 @@
+import io
+import os
+import shutil
+import tarfile
+import unittest
+import zipfile
+
+from atari_8_bit_utils.archive import archive_format, image_stems, write_archive
+from atari_8_bit_utils.atascii import bytes_to_utf8
+
+from .basic_test import LINE_10, LINE_20, program
+from .diskimage_test import atr, dcm, dos_disk
+
+
+class TestArchive(unittest.TestCase):
+
+    files = {
+        'HELLO.TXT': b'HELLO WORLD\x9b',
+        'LONG.DAT': bytes(range(256)) * 2,
+        'FILL.DAT': b'\x55' * 123 + b'END'
+    }
+
+    def setUp(self):
+        self.out_path = 'testdata/out/archive/'
+        shutil.rmtree(self.out_path, ignore_errors=True)
+        os.makedirs(self.out_path)
+        for name, image in [('ONE.atr', atr(dos_disk(self.files))), ('TWO.dcm', dcm(dos_disk(self.files))),
+                            ('BAD.xfd', b'\0' * 100)]:
+            with open(self.out_path + name, 'wb') as f:
+                f.write(image)
+        return super().setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out_path, ignore_errors=True)
+        return super().tearDown()
+
+    def test_format(self):
+        self.assertEqual(archive_format('out.zip'), 'zip')
+        self.assertEqual(archive_format('out.tar.gz'), 'tgz')
+        self.assertEqual(archive_format(None), 'tar')
+        self.assertEqual(archive_format('out.zip', 'tar'), 'tar')
+
+    def test_tar(self):
+        stream = io.BytesIO()
+        results = list(write_archive([self.out_path + 'ONE.atr', self.out_path + 'TWO.dcm'], stream, 'tar', jobs=2))
+        self.assertEqual([(os.path.basename(path), count, error) for path, count, error in results],
+                         [('ONE.atr', 3, None), ('TWO.dcm', 3, None)])
+
+        stream.seek(0)
+        archive = tarfile.open(fileobj=stream)
+        self.assertEqual(len(archive.getnames()), 12)
+        self.assertEqual(archive.extractfile('TWO/atascii/LONG.DAT').read(), self.files['LONG.DAT'])
+        self.assertEqual(archive.extractfile('ONE/utf8/HELLO.TXT').read().decode('utf-8'),
+                         bytes_to_utf8(self.files['HELLO.TXT']))
+
+    def test_zip(self):
+        stream = io.BytesIO()
+        results = list(write_archive([self.out_path], stream, 'zip', jobs=1))
+        self.assertEqual([os.path.basename(path) for path, _, error in results if error], ['BAD.xfd'])
+
+        archive = zipfile.ZipFile(io.BytesIO(stream.getvalue()))
+        self.assertEqual(sorted({name.split('/')[0] for name in archive.namelist()}), ['ONE', 'TWO'])
+        self.assertEqual(archive.read('ONE/atascii/FILL.DAT'), self.files['FILL.DAT'])
+
+    def test_malformed_program(self):
+        good = program([LINE_20])
+        # The string in line 10 runs past the end of the line
+        bad = program([LINE_10[:6] + bytes([40]) + LINE_10[7:]])
+        with open(self.out_path + 'BASIC.atr', 'wb') as f:
+            f.write(atr(dos_disk({'GOOD.BAS': good, 'BAD.BAS': bad})))
+
+        stream = io.BytesIO()
+        results = list(write_archive([self.out_path + 'BASIC.atr'], stream, 'zip', jobs=1, detokenize=True))
+        self.assertEqual([(count, error) for _, count, error in results], [(2, None)])
+
+        archive = zipfile.ZipFile(io.BytesIO(stream.getvalue()))
+        self.assertEqual(archive.read('BASIC/utf8/GOOD.BAS.LST').decode('utf-8'), '20 GOTO 10\n')
+        self.assertEqual(archive.read('BASIC/utf8/BAD.BAS').decode('utf-8'), bytes_to_utf8(bad))
+
+    def test_image_stems(self):
+        self.assertEqual(image_stems(['a/GAME.atr', 'a/GAME.dcm', 'b/GAME.atr', 'a/TOOLS.xfd']),
+                         ['GAME.atr', 'GAME.dcm', 'GAME.atr-2', 'TOOLS'])
+
+    def test_same_stem(self):
+        stream = io.BytesIO()
+        images = [self.out_path + 'ONE.atr', self.out_path + 'ONE.dcm']
+        shutil.copyfile(self.out_path + 'TWO.dcm', images[1])
+        list(write_archive(images, stream, 'tar', jobs=2))
+
+        stream.seek(0)
+        names = tarfile.open(fileobj=stream).getnames()
+        self.assertEqual(len(names), len(set(names)))
+        self.assertEqual(sorted({name.split('/')[0] for name in names}), ['ONE.atr', 'ONE.dcm'])
+
+    def test_unsafe_name(self):
+        disk = dos_disk({'EVIL.TXT': b'EVIL\x9b'})
+        disk[361] = disk[361][:5] + b'../../X ' + disk[361][13:]
+        with open(self.out_path + 'EVIL.atr', 'wb') as f:
+            f.write(atr(disk))
+
+        stream = io.BytesIO()
+        results = list(write_archive([self.out_path + 'EVIL.atr'], stream, 'zip', jobs=1))
+        self.assertIn('ImageError', results[0][2])
+        self.assertEqual(zipfile.ZipFile(io.BytesIO(stream.getvalue())).namelist(), [])
@@ -0,0 +1,97 @@
+import os
+import random
+import shutil
+import struct
+import unittest
+
+from atari_8_bit_utils.atascii import files_to_utf8
+from atari_8_bit_utils.basic import BasicError, Program, detokenize, format_number, is_tokenized
+
+
+def bcd(exponent: int, *mantissa: int) -> bytes:
+    return bytes([exponent] + list(mantissa) + [0] * (5 - len(mantissa)))
+
+
+def program(lines: list, variables: bytes = b'\xc1') -> bytes:
+    '''
+    Builds a SAVEd program with the given tokenized lines and variable names
+    '''
+    vnt = variables + b'\x00'
+    vvt = b'\x00' * 8 * len([b for b in variables if b & 0x80])
+    stmts = b''.join(lines)
+    immediate = bytes([0x00, 0x80, 0x06, 0x06, 0x15, 0x16])
+    vntp = 0x100
+    vntd = vntp + len(vnt) - 1
+    vvtp = vntp + len(vnt)
+    stmtab = vvtp + len(vvt)
+    stmcur = stmtab + len(stmts)
+    starp = stmcur + len(immediate)
+    header = struct.pack('<7H', 0, vntp, vntd, vvtp, stmtab, stmcur, starp)
+    return header + vnt + vvt + stmts + immediate
+
+
+# 10 PRINT "HI":A=1.5
+LINE_10 = bytes([10, 0, 22, 10, 0x20, 0x0f, 2]) + b'HI' + bytes([0x14, 22, 0x36, 0x80, 0x2d, 0x0e]) + bcd(0x40, 0x01, 0x50) + bytes([0x16])
+# 20 GOTO 10
+LINE_20 = bytes([20, 0, 13, 13, 0x0a, 0x0e]) + bcd(0x40, 0x10) + bytes([0x16])
+# 30 REM HELLO
+LINE_30 = bytes([30, 0, 11, 11, 0x00]) + b'HELLO' + bytes([0x9b])
+
+
+class TestBasic(unittest.TestCase):
+
+    def test_listing(self):
+        data = program([LINE_10, LINE_20, LINE_30])
+        listing = b''.join(detokenize(data))
+        self.assertEqual(listing, b'10 PRINT "HI":A=1.5\x9b20 GOTO 10\x9b30 REM HELLO\x9b')
+
+    def test_variables(self):
+        self.assertEqual(Program(program([], b'\xc1AB\xa4C\xa8')).variables, [b'A', b'AB$', b'C('])
+
+    def test_not_tokenized(self):
+        self.assertFalse(is_tokenized(b'10 PRINT "HI"\x9b'))
+        with self.assertRaises(BasicError):
+            Program(program([LINE_10])[:-10])
+
+    def test_malformed_programs(self):
+        data = program([LINE_10, LINE_20, LINE_30])
+        rng = random.Random(8)
+        for _ in range(2000):
+            mutated = bytearray(data)
+            for _ in range(rng.randint(1, 4)):
+                mutated[rng.randrange(len(mutated))] = rng.randrange(256)
+            try:
+                b''.join(detokenize(bytes(mutated)))
+            except BasicError:
+                pass
+
+        # A string that runs past the end of its line
+        with self.assertRaises(BasicError):
+            list(detokenize(program([LINE_10[:6] + bytes([40]) + LINE_10[7:]])))
+
+    def test_malformed_program_falls_back(self):
+        out_path = 'testdata/out/basic/'
+        shutil.rmtree(out_path, ignore_errors=True)
+        os.makedirs(out_path + 'atascii')
+        os.makedirs(out_path + 'utf8')
+        f = open(out_path + 'atascii/BAD.BAS', 'wb')
+        f.write(program([LINE_10[:-9]]))
+        f.close()
+
+        files_to_utf8(out_path + 'atascii', out_path + 'utf8', detokenize=True)
+        self.assertEqual(sorted(os.listdir(out_path + 'utf8')), ['BAD.BAS'])
+        shutil.rmtree(out_path, ignore_errors=True)
+
+    def test_format_number(self):
+        self.assertEqual(format_number(bcd(0)), b'0')
+        self.assertEqual(format_number(bcd(0x40, 0x01)), b'1')
+        self.assertEqual(format_number(bcd(0x41, 0x01, 0x00)), b'100')
+        self.assertEqual(format_number(bcd(0x3f, 0x50)), b'0.5')
+        self.assertEqual(format_number(bcd(0x3f, 0x01)), b'0.01')
+        self.assertEqual(format_number(bcd(0x3e, 0x10)), b'1E-03')
+        self.assertEqual(format_number(bcd(0x45, 0x01)), b'1E+10')
+        self.assertEqual(format_number(bcd(0xc0, 0x03, 0x14, 0x15)), b'-3.1415')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import filecmp
+import io
+import os
+import shutil
+import unittest
+
+from typer.testing import CliRunner
+
+from atari_8_bit_utils.a8utils import app
+from atari_8_bit_utils.atascii import to_utf8
+from atari_8_bit_utils.batch import output_path, read_manifest, read_null_separated, run_batch
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.out_path = 'testdata/out/batch/'
+        shutil.rmtree(self.out_path, ignore_errors=True)
+        os.makedirs(self.out_path)
+        return super().setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out_path, ignore_errors=True)
+        return super().tearDown()
+
+    def test_output_path(self):
+        self.assertEqual(output_path('testdata/atascii/TEST.TXT', 'out'), os.path.join('out', 'testdata/atascii/TEST.TXT'))
+        self.assertEqual(output_path('/elsewhere/TEST.TXT', 'out'), os.path.join('out', 'TEST.TXT'))
+        with self.assertRaises(ValueError):
+            output_path('TEST.TXT', None)
+
+    def test_inputs(self):
+        manifest = self.out_path + 'manifest.txt'
+        with open(manifest, 'w') as f:
+            f.write('# comment\nA.TXT\tB.TXT\n\nC.TXT\n')
+        self.assertEqual(read_manifest(manifest, 'out'), [('A.TXT', 'B.TXT'), ('C.TXT', os.path.join('out', 'C.TXT'))])
+        self.assertEqual(read_null_separated(io.BytesIO(b'A.TXT\0B.TXT\0'), 'out'),
+                         [('A.TXT', os.path.join('out', 'A.TXT')), ('B.TXT', os.path.join('out', 'B.TXT'))])
+
+    def test_missing_manifest(self):
+        runner = CliRunner()
+        for args in [['ata2utf', '--output-dir', self.out_path], ['utf2ata', '--check']]:
+            result = runner.invoke(app, args + ['--manifest', self.out_path + 'missing.txt'])
+            self.assertEqual(result.exit_code, 2)
+            self.assertNotIsInstance(result.exception, OSError)
+            self.assertIn('--manifest', result.output)
+
+    def test_run_batch(self):
+        pairs = [
+            ('testdata/atascii/TEST.TXT', self.out_path + 'one/TEST.TXT'),
+            ('testdata/atascii/COMPLETE.TXT', self.out_path + 'two/COMPLETE.TXT'),
+            ('testdata/atascii/MISSING.TXT', self.out_path + 'MISSING.TXT'),
+        ]
+        for jobs in [1, 2]:
+            results = list(run_batch(pairs, 'utf8', jobs))
+            self.assertEqual([error is None for _, _, error in results], [True, True, False])
+
+        to_utf8('testdata/atascii/TEST.TXT', self.out_path + 'TEST.TXT')
+        self.assertTrue(filecmp.cmp(self.out_path + 'TEST.TXT', self.out_path + 'one/TEST.TXT', shallow=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import asyncio
 from collections.abc import Callable
 import unittest
 
@@ -69,3 +70,39 @@ class TestBehaviors(unittest.TestCase):
         self.assertEqual(i, 8)
         # self.assertEqual(names, [])
         self.assertEqual(result, Result.SUCCESS)
+
+
+class TestAsyncBehaviors(unittest.TestCase):
+
+    def test_async_tick_matches_sync(self):
+        sync_names = []
+        async_names = []
+
+        def sync_action(name):
+            sync_names.append(name)
+            return Result.SUCCESS if name in ['Wait', 'WriteUTF8'] else Result.FAILURE
+
+        def async_action(name):
+            async def run():
+                await asyncio.sleep(0)
+                async_names.append(name)
+                return Result.SUCCESS if name in ['Wait', 'WriteUTF8'] else Result.FAILURE
+            return run
+
+        def build(tree, item, action):
+            if isinstance(item, str):
+                return tree.add_leaf(item, action(item))
+            if item.get('ref'):
+                return tree.behaviors.get(item['ref'])
+            children = [build(tree, c, action) for c in item['children']]
+            if item['type'] == 'Sequence':
+                return tree.add_sequence(item['name'], children)
+            return tree.add_selector(item['name'], children)
+
+        sync_tree = BehaviorTree()
+        sync_tree.set_root(build(sync_tree, atr_tree, lambda n: lambda: sync_action(n)))
+        async_tree = BehaviorTree()
+        async_tree.set_root(build(async_tree, atr_tree, async_action))
+
+        self.assertEqual(sync_tree.tick(), asyncio.run(async_tree.tick_async()))
+        self.assertEqual(sync_names, async_names)
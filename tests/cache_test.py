@@ -0,0 +1,91 @@
+import filecmp
+import os
+import shutil
+import time
+import unittest
+
+from atari_8_bit_utils.atascii import files_to_utf8, to_utf8
+from atari_8_bit_utils.cache import Cache
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.out_path = 'testdata/out/cache/'
+        shutil.rmtree(self.out_path, ignore_errors=True)
+        os.makedirs(self.out_path + 'utf8')
+        self.cache = Cache(self.out_path + 'cache')
+        return super().setUp()
+
+    def tearDown(self):
+        self.cache.db.close()
+        shutil.rmtree(self.out_path, ignore_errors=True)
+        return super().tearDown()
+
+    def test_hit_after_miss(self):
+        convert = self.cache.converter('utf8', to_utf8)
+        convert('testdata/atascii/TEST.TXT', self.out_path + 'A.TXT')
+        convert('testdata/atascii/TEST.TXT', self.out_path + 'B.TXT')
+        to_utf8('testdata/atascii/TEST.TXT', self.out_path + 'C.TXT')
+
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertTrue(filecmp.cmp(self.out_path + 'B.TXT', self.out_path + 'C.TXT', shallow=False))
+
+    def test_outputs_are_independent(self):
+        convert = self.cache.converter('utf8', to_utf8)
+        convert('testdata/atascii/TEST.TXT', self.out_path + 'A.TXT')
+        convert('testdata/atascii/TEST.TXT', self.out_path + 'B.TXT')
+        self.assertNotEqual(os.stat(self.out_path + 'A.TXT').st_ino, os.stat(self.out_path + 'B.TXT').st_ino)
+        self.assertTrue(os.access(self.out_path + 'B.TXT', os.W_OK))
+
+        # Overwriting a materialized output must leave the cache entry alone
+        to_utf8('testdata/atascii/COMPLETE.TXT', self.out_path + 'A.TXT')
+        convert('testdata/atascii/TEST.TXT', self.out_path + 'C.TXT')
+        self.assertTrue(filecmp.cmp(self.out_path + 'B.TXT', self.out_path + 'C.TXT', shallow=False))
+
+    def test_directions_are_separate(self):
+        data = b'HELLO'
+        self.assertNotEqual(self.cache.key(data, 'utf8'), self.cache.key(data, 'atascii'))
+
+    def test_files_to_utf8(self):
+        files_to_utf8('testdata/atascii', self.out_path + 'utf8', cache=self.cache)
+        files_to_utf8('testdata/atascii', self.out_path + 'utf8', cache=self.cache)
+        self.assertEqual(self.cache.hits, self.cache.misses)
+        self.assertEqual(self.cache.stats()['entries'], len(os.listdir('testdata/atascii')))
+
+    def test_hits_are_written_once(self):
+        files_to_utf8('testdata/atascii', self.out_path + 'utf8', cache=self.cache)
+        changes = self.cache.db.total_changes
+        files_to_utf8('testdata/atascii', self.out_path + 'utf8', cache=self.cache)
+        # One last use time per entry and one counter, all in a single flush
+        self.assertEqual(self.cache.db.total_changes - changes, len(os.listdir('testdata/atascii')) + 1)
+        self.assertEqual(self.cache.stats()['total_hits'], len(os.listdir('testdata/atascii')))
+
+    def test_warm_hit_is_cheaper_than_converting(self):
+        os.makedirs(self.out_path + 'many')
+        for i in range(200):
+            with open(self.out_path + f'many/F{i}.TXT', 'wb') as f:
+                f.write(bytes((i + j) % 128 for j in range(2000)))
+
+        def best(cache):
+            times = []
+            for _ in range(3):
+                start = time.perf_counter()
+                files_to_utf8(self.out_path + 'many', self.out_path + 'utf8', cache=cache)
+                times.append(time.perf_counter() - start)
+            return min(times)
+
+        files_to_utf8(self.out_path + 'many', self.out_path + 'utf8', cache=self.cache)
+        self.assertLess(best(self.cache), best(None))
+
+    def test_eviction(self):
+        convert = self.cache.converter('utf8', to_utf8)
+        convert('testdata/atascii/TEST.TXT', self.out_path + 'A.TXT')
+        self.cache.max_size = 1
+        convert('testdata/atascii/COMPLETE.TXT', self.out_path + 'B.TXT')
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self.assertTrue(os.path.isfile(self.out_path + 'B.TXT'))
+
+
+if __name__ == '__main__':
+    unittest.main()
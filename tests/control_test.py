@@ -0,0 +1,51 @@
+import time
+import unittest
+
+from atari_8_bit_utils.control import Controller, send_command, start_server
+
+
+class TestControlChannel(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.controller = Controller()
+        return super().setUp()
+
+    def test_pause_resume(self):
+        self.controller.handle('pause')
+        self.assertTrue(self.controller.paused)
+        self.controller.handle('resume')
+        self.assertFalse(self.controller.paused)
+
+    def test_unknown_command(self):
+        response = self.controller.handle('bogus')
+        self.assertFalse(response['ok'])
+
+    def test_tick_wakes_sleep(self):
+        self.controller.handle('tick')
+        start = time.perf_counter()
+        self.assertEqual(self.controller.sleep(10), 'tick')
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_shutdown_unpauses(self):
+        self.controller.pause()
+        self.controller.handle('shutdown')
+        self.assertTrue(self.controller.shutdown_requested)
+        self.assertFalse(self.controller.paused)
+
+    def test_server_roundtrip(self):
+        server = start_server(self.controller, 0)
+        try:
+            port = server.server_address[1]
+            self.controller.record_tick(time.time(), 0.25, 1)
+            response = send_command('status', port)
+            self.assertTrue(response['ok'])
+            self.assertEqual(response['ticks'][0]['duration'], 0.25)
+            send_command('pause', port)
+            self.assertTrue(self.controller.paused)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
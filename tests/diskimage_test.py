@@ -0,0 +1,195 @@
+import io
+import os
+import shutil
+import struct
+import unittest
+
+from atari_8_bit_utils.diskimage import Disk, Dos2, ImageError, extract_image, read_image
+
+
+def dos_disk(files: dict, sector_size: int = 128, sectors: int = 720) -> dict:
+    '''
+    Builds the sectors of a DOS 2 disk holding files, as a dict of sector number to data
+    '''
+    disk = {}
+    directory = bytearray(8 * 128)
+    next_sector = 4
+    per_sector = sector_size - 3
+    for index, (filename, content) in enumerate(files.items()):
+        chunks = [content[i:i + per_sector] for i in range(0, len(content), per_sector)] or [b'']
+        start = next_sector
+        for i, chunk in enumerate(chunks):
+            link = next_sector + 1 if i < len(chunks) - 1 else 0
+            data = bytearray(sector_size)
+            data[:len(chunk)] = chunk
+            data[-3] = index << 2 | link >> 8
+            data[-2] = link & 0xff
+            data[-1] = len(chunk)
+            disk[next_sector] = bytes(data)
+            next_sector += 1
+        name, ext = filename.split('.')
+        entry = struct.pack('<BHH', 0x42, len(chunks), start) + name.ljust(8).encode() + ext.ljust(3).encode()
+        directory[index * 16:(index + 1) * 16] = entry
+    for i in range(8):
+        disk[361 + i] = bytes(directory[i * 128:(i + 1) * 128]).ljust(sector_size, b'\0')
+    disk[360] = bytes(sector_size)
+    disk['count'] = sectors
+    return disk
+
+
+def raw_sectors(disk: dict, sector_size: int) -> bytes:
+    data = b''
+    for sector in range(1, disk['count'] + 1):
+        size = 128 if sector <= 3 else sector_size
+        data += disk.get(sector, bytes(size))
+    return data
+
+
+def atr(disk: dict, sector_size: int = 128) -> bytes:
+    data = raw_sectors(disk, sector_size)
+    paragraphs = len(data) // 16
+    header = struct.pack('<HHHB9x', 0x0296, paragraphs & 0xffff, sector_size, paragraphs >> 16)
+    return header + data
+
+
+def dcm(disk: dict) -> bytes:
+    '''
+    Encodes a single density disk using every DCM record type
+    '''
+    sectors = [s for s in range(1, disk['count'] + 1) if s in disk and any(disk[s])]
+    out = bytearray([0xfa, 0x80]) + struct.pack('<H', sectors[0])
+    previous = bytes(128)
+    for i, sector in enumerate(sectors):
+        data = disk[sector]
+        if data == previous:
+            record = bytes([0x46])
+        elif data[:64] == previous[:64]:
+            record = bytes([0x44, 64]) + data[64:]
+        elif data[64:] == previous[64:]:
+            record = bytes([0x41, 63]) + data[:64][::-1]
+        elif data[:123] == bytes([data[0]]) * 123:
+            record = bytes([0x42, data[0]]) + data[123:]
+        elif i % 2 and data[16:125] == bytes(109):
+            # One literal run up to offset 16, one zero fill run up to 125 and the rest literal
+            record = bytes([0x43, 16]) + data[:16] + bytes([125, 0]) + bytes([0]) + data[125:]
+        elif data[:16] == bytes([data[0]]) * 16:
+            # An empty literal run, a fill run up to offset 16 and the rest literal
+            record = bytes([0x43, 0, 16, data[0], 0]) + data[16:]
+        else:
+            record = bytes([0x47]) + data
+        following = sectors[i + 1] if i + 1 < len(sectors) else None
+        if following == sector + 1:
+            out += bytes([record[0] | 0x80]) + record[1:]
+        else:
+            out += record + struct.pack('<H', following or 0)
+        previous = data
+    out += bytes([0x45])
+    return bytes(out)
+
+
+def atx(disk: dict) -> bytes:
+    '''
+    Encodes a single density disk as 40 ATX track records, with the sectors in reverse order
+    '''
+    tracks = b''
+    for track in range(40):
+        numbers = list(range(18, 0, -1))
+        data = b''.join(disk.get(track * 18 + n, bytes(128)) for n in numbers)
+        list_size = 8 + 8 * len(numbers)
+        data_start = 32 + list_size + 8
+        entries = b''.join(struct.pack('<BBHI', n, 0, 0, data_start + i * 128) for i, n in enumerate(numbers))
+        body = struct.pack('<IBBH', list_size, 1, 0, 0) + entries + struct.pack('<IBBH', 8 + len(data), 0, 0, 0) + data
+        body += struct.pack('<I4x', 0)
+        size = 32 + len(body)
+        tracks += struct.pack('<IHHBBHHHII8x', size, 0, 0, track, 0, 18, 0, 0, 0, 32) + body
+    header = b'AT8X' + struct.pack('<HHHHIHBBIHHII12x', 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 48, 48 + len(tracks))
+    return header + tracks
+
+
+class TestDiskImage(unittest.TestCase):
+
+    files = {
+        'HELLO.TXT': b'HELLO WORLD\x9b',
+        'LONG.DAT': bytes(range(256)) * 2,
+        'FILL.DAT': b'\x55' * 123 + b'END'
+    }
+
+    def setUp(self):
+        self.out_path = 'testdata/out/diskimage/'
+        shutil.rmtree(self.out_path, ignore_errors=True)
+        os.makedirs(self.out_path)
+        return super().setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out_path, ignore_errors=True)
+        return super().tearDown()
+
+    def assertFiles(self, image: bytes, name: str):
+        disk = Disk(read_image(io.BytesIO(image), name, len(image)))
+        fs = Dos2(disk)
+        names = [entry.filename for entry in fs.walk()]
+        self.assertEqual(names, list(self.files))
+        for entry in fs.walk():
+            self.assertEqual(b''.join(fs.read(entry)), self.files[entry.filename], f'{name}: {entry.filename}')
+
+    def test_atr(self):
+        self.assertFiles(atr(dos_disk(self.files)), 'disk.atr')
+
+    def test_double_density(self):
+        disk = dos_disk(self.files, 256)
+        self.assertFiles(atr(disk, 256), 'disk.atr')
+        self.assertFiles(raw_sectors(disk, 256), 'disk.xfd')
+
+    def test_xfd(self):
+        self.assertFiles(raw_sectors(dos_disk(self.files), 128), 'disk.xfd')
+
+    def test_dcm(self):
+        disk = dos_disk(self.files)
+        # Identical and partly identical sectors exercise the delta records
+        disk[400] = disk[401] = b'\x01' * 128
+        disk[402] = b'\x01' * 64 + b'\x02' * 64
+        disk[403] = b'\x03' * 64 + b'\x02' * 64
+        # Starts with a fill run
+        disk[404] = b'\x04' * 16 + bytes(range(112))
+        image = dcm(disk)
+        self.assertEqual(Disk(read_image(io.BytesIO(image), 'disk.dcm')).sectors, Disk(read_image(io.BytesIO(atr(disk)), 'disk.atr')).sectors)
+        self.assertFiles(image, 'disk.dcm')
+
+    def test_extract_unsafe_name(self):
+        disk = dos_disk({'EVIL.TXT': b'EVIL\x9b'})
+        disk[361] = disk[361][:5] + b'../../X ' + disk[361][13:]
+        image = self.out_path + 'evil.xfd'
+        with open(image, 'wb') as f:
+            f.write(raw_sectors(disk, 128))
+        with self.assertRaises(ImageError):
+            extract_image(image, self.out_path + 'files/sub')
+        self.assertFalse(os.path.exists(self.out_path + 'X.TXT'))
+
+    def test_dcm_fixture(self):
+        # Written by hand following the dcm2atr decoder, with records that start
+        # with a fill run, i.e. an empty first literal run
+        disk = Disk.open('testdata/dcm/runs.dcm')
+        self.assertEqual(disk.sectors, {
+            1: b'\xaa' * 64 + bytes(range(0x40, 0x80)),
+            2: b'ABCD' + bytes(124),
+            3: b'\x20' * 123 + b'12345',
+            361: b'\x9b' * 16 + b'WXYZ' + b'\x55' * 108
+        })
+
+    def test_atx(self):
+        self.assertFiles(atx(dos_disk(self.files)), 'disk.atx')
+
+    def test_detect_format(self):
+        self.assertFiles(atr(dos_disk(self.files)), 'disk.img')
+        self.assertFiles(dcm(dos_disk(self.files)), 'disk.img')
+        with self.assertRaises(ImageError):
+            read_image(io.BytesIO(b'\0' * 64), 'disk.img')
+
+    def test_extract_image(self):
+        image = self.out_path + 'disk.dcm'
+        with open(image, 'wb') as f:
+            f.write(dcm(dos_disk(self.files)))
+        written = extract_image(image, self.out_path + 'files')
+        self.assertEqual(written, list(self.files))
+        with open(self.out_path + 'files/LONG.DAT', 'rb') as f:
+            self.assertEqual(f.read(), self.files['LONG.DAT'])
@@ -0,0 +1,66 @@
+import os
+import shutil
+import time
+import unittest
+
+from atari_8_bit_utils.filestate import DirState, FileState, diff, scan
+
+
+def state(**files) -> DirState:
+    return DirState(FileState(name, checksum) for name, checksum in files.items())
+
+
+class TestFileState(unittest.TestCase):
+
+    def setUp(self):
+        self.out_path = 'testdata/out/filestate/'
+        shutil.rmtree(self.out_path, ignore_errors=True)
+        os.makedirs(self.out_path)
+        return super().setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out_path, ignore_errors=True)
+        return super().tearDown()
+
+    def test_diff(self):
+        old = state(A='1', B='2', C='3', E='5')
+        new = state(B='2', C='x', D='4', F='6')
+        changes = diff(old, new)
+        self.assertEqual(changes.added, ['D', 'F'])
+        self.assertEqual(changes.removed, ['A', 'E'])
+        self.assertEqual(changes.modified, ['C'])
+        self.assertFalse(diff(old, state(A='1', B='2', C='3', E='5')))
+        self.assertEqual(diff(None, new).added, ['B', 'C', 'D', 'F'])
+
+    def test_json(self):
+        entries = [{'name': 'B', 'checksum': '2'}, {'name': 'A', 'checksum': '1'}]
+        loaded = DirState.from_json(entries)
+        self.assertEqual(loaded.names(), ['A', 'B'])
+        self.assertEqual(loaded.to_json(), sorted(entries, key=lambda e: e['name']))
+        self.assertEqual(loaded, entries)
+        self.assertEqual(loaded[0], FileState('A', '1'))
+        self.assertIsNone(DirState.from_json(None))
+        self.assertFalse(DirState())
+
+    def test_scan_reuses_checksums(self):
+        for name in ['A.TXT', 'B.TXT']:
+            with open(self.out_path + name, 'w') as f:
+                f.write(name)
+        # Make the files old enough for their checksums to be trusted
+        past = time.time() - 60
+        os.utime(self.out_path + 'A.TXT', (past, past))
+        os.utime(self.out_path + 'B.TXT', (past, past))
+
+        first, hashed = scan(self.out_path, '\\.TXT$')
+        self.assertEqual(first.names(), ['A.TXT', 'B.TXT'])
+        self.assertEqual(hashed, 10)
+
+        second, hashed = scan(self.out_path, '\\.TXT$', first)
+        self.assertEqual(hashed, 0)
+        self.assertEqual(second, first)
+
+        with open(self.out_path + 'B.TXT', 'w') as f:
+            f.write('CHANGED')
+        third, hashed = scan(self.out_path, '\\.TXT$', second)
+        self.assertEqual(hashed, 7)
+        self.assertEqual(diff(second, third).modified, ['B.TXT'])
@@ -0,0 +1,68 @@
+import os
+import shutil
+import unittest
+
+from atari_8_bit_utils.index import Index, format_sectors
+
+from .diskimage_test import atr, dcm, dos_disk
+
+
+class TestIndex(unittest.TestCase):
+
+    files = {
+        'HELLO.TXT': b'HELLO WORLD\x9b',
+        'LONG.DAT': bytes(range(256)) * 2,
+        'PROG.LST': b'10 PRINT "HI"\x9b20 GOTO 10\x9b'
+    }
+
+    def setUp(self):
+        self.out_path = 'testdata/out/index/'
+        shutil.rmtree(self.out_path, ignore_errors=True)
+        os.makedirs(self.out_path + 'images/sub')
+        self.write('images/ONE.atr', atr(dos_disk(self.files)))
+        self.write('images/sub/TWO.dcm', dcm(dos_disk({'HELLO.TXT': self.files['HELLO.TXT']})))
+        self.index = Index(self.out_path + 'index.sqlite')
+        return super().setUp()
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.out_path, ignore_errors=True)
+        return super().tearDown()
+
+    def write(self, name: str, data: bytes):
+        with open(self.out_path + name, 'wb') as f:
+            f.write(data)
+
+    def test_format_sectors(self):
+        self.assertEqual(format_sectors([4, 5, 6, 9, 11, 12]), '4-6,9,11-12')
+        self.assertEqual(format_sectors([]), '')
+
+    def test_update(self):
+        root = self.out_path + 'images'
+        self.assertEqual(self.index.update([root], jobs=2)['added'], 2)
+        self.assertEqual(self.index.update([root])['unchanged'], 2)
+
+        # Same content, new mtime
+        os.utime(self.out_path + 'images/ONE.atr', (0, 0))
+        self.assertEqual(self.index.update([root])['touched'], 1)
+
+        self.write('images/ONE.atr', atr(dos_disk({'OTHER.TXT': b'OTHER\x9b'})))
+        os.remove(self.out_path + 'images/sub/TWO.dcm')
+        stats = self.index.update([root])
+        self.assertEqual((stats['updated'], stats['removed']), (1, 1))
+        self.assertEqual(self.index.stats(), {'images': 1, 'failed': 0, 'files': 1, 'contents': 1})
+
+    def test_search(self):
+        self.index.update([self.out_path + 'images'], jobs=1)
+
+        results = self.index.search(name='hello.*')
+        self.assertEqual([os.path.basename(r['image']) for r in results], ['ONE.atr', 'TWO.dcm'])
+        self.assertEqual(results[0]['checksum'], results[1]['checksum'])
+        self.assertEqual(results[0]['sectors'], '4')
+
+        checksum = results[0]['checksum']
+        self.assertEqual(len(self.index.search(checksum=checksum[:6])), 2)
+        self.assertEqual([r['path'] for r in self.index.search(text='goto 10')], ['PROG.LST'])
+        self.assertEqual([r['path'] for r in self.index.search(text='I"')], ['PROG.LST'])
+        self.assertEqual(self.index.search(text='100%'), [])
+        self.assertEqual(len(self.index.search(name='*.TXT', text='world')), 2)
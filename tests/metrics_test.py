@@ -0,0 +1,32 @@
+import unittest
+
+from atari_8_bit_utils.metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_prometheus(self):
+        metrics = Metrics()
+        metrics.inc('hash_bytes_total', 100, project='a')
+        metrics.inc('hash_bytes_total', 50, project='a')
+        metrics.observe('phase_seconds', 0.02, phase='scan', project='a')
+        metrics.observe('phase_seconds', 3, phase='scan', project='a')
+        text = metrics.to_prometheus()
+
+        self.assertIn('# TYPE a8utils_sync_hash_bytes_total counter', text)
+        self.assertIn('a8utils_sync_hash_bytes_total{project="a"} 150', text)
+        self.assertIn('a8utils_sync_phase_seconds_bucket{phase="scan",project="a",le="0.025"} 1', text)
+        self.assertIn('a8utils_sync_phase_seconds_bucket{phase="scan",project="a",le="+Inf"} 2', text)
+        self.assertIn('a8utils_sync_phase_seconds_count{phase="scan",project="a"} 2', text)
+
+    def test_timer(self):
+        metrics = Metrics()
+        with metrics.timer('git', project='b'):
+            pass
+        histogram = metrics.to_dict()['histograms'][0]
+        self.assertEqual(histogram['labels'], {'phase': 'git', 'project': 'b'})
+        self.assertEqual(histogram['value']['count'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
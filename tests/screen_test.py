@@ -0,0 +1,86 @@
+import io
+import os
+import shutil
+import unittest
+
+from atari_8_bit_utils.atascii import translate
+from atari_8_bit_utils.screen import Renderer, diff_frames, read_frames, to_atascii
+
+
+def internal(text: str, inverse: bool = False) -> bytes:
+    '''
+    Encodes printable ASCII as internal character codes
+    '''
+    codes = bytearray()
+    for c in text:
+        code = ord(c)
+        if 0x20 <= code < 0x60:
+            code -= 0x20
+        codes.append(code | (0x80 if inverse else 0))
+    return bytes(codes)
+
+
+class TestScreen(unittest.TestCase):
+
+    def setUp(self):
+        self.out_path = 'testdata/out/screen/'
+        shutil.rmtree(self.out_path, ignore_errors=True)
+        os.makedirs(self.out_path + 'expected')
+        os.makedirs(self.out_path + 'actual')
+        return super().setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out_path, ignore_errors=True)
+        return super().tearDown()
+
+    def test_to_atascii(self):
+        self.assertEqual(to_atascii(0x00), 0x20)
+        self.assertEqual(to_atascii(0x21), ord('A'))
+        self.assertEqual(to_atascii(0x40), 0x00)
+        self.assertEqual(to_atascii(0x61), ord('a'))
+        self.assertEqual(to_atascii(0xa1), ord('A') | 0x80)
+        # Every ATASCII code appears exactly once
+        self.assertEqual(sorted(to_atascii(code) for code in range(0x100)), list(range(0x100)))
+
+    def test_render(self):
+        renderer = Renderer('gr0', 8, 3)
+        frame = internal('HELLO'.ljust(8)) + internal('INV', True) + internal(' ' * 5) + bytes([0x40, 0xdb]) + bytes(6)
+        lines = renderer.render(frame).splitlines()
+        self.assertEqual(lines[0], 'HELLO   ')
+        self.assertEqual(lines[1], '`I`N`V     ')
+        self.assertEqual(lines[2][0], translate[0])
+        # Inverse ESC isn't rendered as a line end
+        self.assertNotIn('\n', lines[2])
+
+        ansi = Renderer('gr0', 8, 3, ansi=True).render(frame).splitlines()
+        self.assertTrue(ansi[1].startswith('\x1b[7mI\x1b[27m'))
+
+    def test_reuses_rows(self):
+        renderer = Renderer('gr0', 4, 3)
+        first = internal('AAAABBBBCCCC')
+        self.assertEqual(renderer.update(first), [0, 1, 2])
+        self.assertEqual(renderer.update(first), [])
+        self.assertEqual(renderer.update(internal('AAAAXBBBCCCC')), [1])
+        self.assertEqual(renderer.lines, ['AAAA', 'XBBB', 'CCCC'])
+
+    def test_graphics_modes(self):
+        renderer = Renderer('gr1', 4, 1)
+        # The top two bits select the color
+        self.assertEqual(renderer.render(bytes([0x21, 0x61, 0xa1, 0xe1])), 'AAAA\n')
+        self.assertEqual(renderer.frame_size, 4)
+
+    def test_read_frames(self):
+        self.assertEqual(list(read_frames(io.BytesIO(b'abcdefg'), 3)), [b'abc', b'def'])
+
+    def test_diff_frames(self):
+        same = internal('SAME'.ljust(40)) * 24
+        changed = internal('DIFF'.ljust(40)) + same[40:]
+        for name, expected, actual in [('one.bin', same * 2, same * 2), ('two.bin', same * 2, same + changed)]:
+            with open(self.out_path + 'expected/' + name, 'wb') as f:
+                f.write(expected)
+            with open(self.out_path + 'actual/' + name, 'wb') as f:
+                f.write(actual)
+
+        differences = list(diff_frames(self.out_path + 'expected', self.out_path + 'actual'))
+        self.assertEqual([(name, frame) for name, frame, _ in differences], [('two.bin', 1)])
+        self.assertIn('+DIFF', differences[0][2])
@@ -0,0 +1,144 @@
+from concurrent.futures import Future, wait
+import heapq
+import os
+import shutil
+import threading
+import time
+import unittest
+from unittest import mock
+
+from atari_8_bit_utils.supervisor import Supervisor, expand_root
+from atari_8_bit_utils.sync import Project, controller
+
+
+class SlowProject(Project):
+    '''
+    Takes a while for its only tick
+    '''
+
+    def tick(self):
+        time.sleep(0.2)
+        self.done = True
+
+
+class IdleProject(Project):
+    '''
+    Only counts its ticks, and isn't due again for a minute after each one
+    '''
+    ticks = 0
+
+    def tick(self):
+        self.ticks += 1
+        self.next_due = time.monotonic() + 60
+        self.done = self.ticks >= 2
+
+
+class TestSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        self.root = 'testdata/out/supervisor/'
+        shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.root + 'atr')
+        return super().setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        return super().tearDown()
+
+    def touch(self, name):
+        open(self.root + 'atr/' + name, 'wb').close()
+
+    def test_single_image_uses_classic_layout(self):
+        self.touch('ONE.atr')
+        projects = expand_root(self.root)
+        self.assertEqual(len(projects), 1)
+        self.assertEqual(projects[0].state_file, os.path.join(self.root, 'state.json'))
+        self.assertIsNone(projects[0].atr)
+
+    def test_multiple_images(self):
+        self.touch('ONE.atr')
+        self.touch('TWO.atr')
+        self.touch('README.TXT')
+        projects = expand_root(self.root)
+        self.assertEqual([p.atr for p in projects], ['ONE.atr', 'TWO.atr'])
+        self.assertEqual(projects[1].utf8_dir, os.path.join(self.root, 'utf8', 'TWO'))
+        self.assertEqual(projects[1].state_file, os.path.join(self.root, 'state.TWO.json'))
+
+    def test_same_stem_different_format(self):
+        self.touch('GAME.atr')
+        self.touch('GAME.dcm')
+        self.touch('TOOLS.xfd')
+        projects = expand_root(self.root)
+        self.assertEqual([os.path.basename(p.state_file) for p in projects],
+                         ['state.GAME.atr.json', 'state.GAME.dcm.json', 'state.TOOLS.json'])
+        self.assertEqual(len({p.utf8_dir for p in projects}), 3)
+        self.assertEqual(len({p.atascii_dir for p in projects}), 3)
+
+    def test_projects_in_one_root_commit_one_at_a_time(self):
+        self.touch('ONE.atr')
+        self.touch('TWO.atr')
+        projects = expand_root(self.root)
+        running, overlaps, commits = [], [], []
+
+        def run(args):
+            running.append(args)
+            overlaps.append(len(running) > 1)
+            time.sleep(0.02)
+            running.remove(args)
+            if 'commit' in args:
+                commits.append(args)
+
+        with mock.patch('atari_8_bit_utils.sync.subprocess.run', side_effect=run):
+            threads = [threading.Thread(target=project.commit) for project in projects]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(overlaps), 6)
+        self.assertFalse(any(overlaps))
+        # Each commit is limited to the directories of its own project
+        self.assertEqual(sorted(os.path.basename(args[-1]) for args in commits), ['ONE', 'TWO'])
+
+    def test_busy_project_goes_to_back_of_queue(self):
+        projects = [Project(self.root, name=name) for name in ['a', 'b']]
+        supervisor = Supervisor(projects, jobs=1)
+        for project in projects:
+            supervisor.schedule(project)
+
+        # Simulate a tick of 'a' that had work to do, i.e. never reached Wait
+        _, _, first = heapq.heappop(supervisor.queue)
+        future = Future()
+        future.set_result(None)
+        supervisor.in_flight[future] = first
+        supervisor.finished(future)
+
+        self.assertEqual([p.name for _, _, p in sorted(supervisor.queue)], ['b', 'a'])
+        supervisor.executor.shutdown()
+
+    def test_busy_workers_dont_spin(self):
+        projects = [SlowProject(self.root, name=name) for name in ['a', 'b', 'c']]
+        supervisor = Supervisor(projects, jobs=1)
+        with mock.patch('atari_8_bit_utils.supervisor.wait', side_effect=wait) as waited:
+            supervisor.run()
+        self.assertTrue(all(project.done for project in projects))
+        # Three ticks of 0.2 seconds, polled every 0.25 seconds at most
+        self.assertLess(waited.call_count, 15)
+
+    def test_tick_wakes_idle_supervisor(self):
+        project = IdleProject(self.root, name='idle')
+        supervisor = Supervisor([project], jobs=1)
+        thread = threading.Thread(target=supervisor.run, daemon=True)
+        thread.start()
+
+        deadline = time.monotonic() + 5
+        while not (project.ticks == 1 and controller.state == 'waiting') and time.monotonic() < deadline:
+            time.sleep(0.01)
+        controller.trigger()
+        thread.join(5)
+        self.assertEqual(project.ticks, 2)
+        self.assertFalse(thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import shutil
+import unittest
+
+from atari_8_bit_utils.behavior import Result
+from atari_8_bit_utils.sync import Project
+
+from .diskimage_test import dos_disk, raw_sectors
+
+
+class TestProject(unittest.TestCase):
+
+    files = {
+        'HELLO.TXT': b'HELLO WORLD\x9b',
+        'LONG.DAT': bytes(range(256)) * 2
+    }
+
+    def setUp(self):
+        self.root = 'testdata/out/sync/'
+        shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.root + 'atr')
+        return super().setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        return super().tearDown()
+
+    def write_image(self, name: str, data: bytes):
+        with open(self.root + 'atr/' + name, 'wb') as f:
+            f.write(data)
+
+    def test_extract_image(self):
+        self.write_image('DISK.xfd', raw_sectors(dos_disk(self.files), 128))
+        project = Project(self.root)
+        project.init()
+        self.assertEqual(project.extract_atr(), Result.SUCCESS)
+        self.assertEqual(sorted(os.listdir(project.atascii_dir)), sorted(self.files))
+
+    def test_unreadable_image_fails(self):
+        # Truncated, e.g. because it is still being written
+        self.write_image('DISK.xfd', raw_sectors(dos_disk(self.files), 128)[:1000])
+        project = Project(self.root)
+        project.init()
+        self.assertEqual(project.extract_atr(), Result.FAILURE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import unittest
+
+from typer.testing import CliRunner
+
+from atari_8_bit_utils.a8utils import app
+
+from atari_8_bit_utils.atascii import to_atascii
+from atari_8_bit_utils.validate import check_files, check_text
+
+
+class TestValidate(unittest.TestCase):
+
+    def setUp(self):
+        self.out_path = 'testdata/out/validate/'
+        shutil.rmtree(self.out_path, ignore_errors=True)
+        os.makedirs(self.out_path)
+        return super().setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out_path, ignore_errors=True)
+        return super().tearDown()
+
+    def test_check_text(self):
+        self.assertEqual(list(check_text('HELLO ♥ `♥ `A\n')), [])
+        # '` ' is an inverse space, '``' isn't valid
+        problems = list(check_text('OK\nA€B\n\nX` ``'))
+        self.assertEqual([(line, column) for line, column, _ in problems], [(2, 2), (4, 4), (4, 5)])
+        self.assertIn('U+20AC', problems[0][2])
+        self.assertIn('escape', problems[1][2])
+
+    def test_utf8_testdata(self):
+        self.assertEqual(list(check_files(['testdata/utf8'], jobs=2)), [])
+
+    def test_matches_to_atascii(self):
+        samples = {
+            'good.txt': 'HELLO\n`♥ ◣',
+            'euro.txt': 'PRICE: 5€',
+            'escape.txt': 'END`'
+        }
+        for name, text in samples.items():
+            with open(self.out_path + name, 'w', encoding='utf-8') as f:
+                f.write(text)
+        with open(self.out_path + 'binary.txt', 'wb') as f:
+            f.write(b'\xff\xfe')
+
+        problems = list(check_files([self.out_path], jobs=2))
+        failing = sorted({os.path.basename(path) for path, _, _, _ in problems})
+        self.assertEqual(failing, ['binary.txt', 'escape.txt', 'euro.txt'])
+
+        for name in samples:
+            input = self.out_path + name
+            if name in failing:
+                with self.assertRaises((KeyError, IndexError)):
+                    to_atascii(input, input + '.atascii')
+            else:
+                to_atascii(input, input + '.atascii')
+
+    def test_cli_checks_every_input(self):
+        good, bad = self.out_path + 'good.txt', self.out_path + 'bad.txt'
+        with open(good, 'w', encoding='utf-8') as f:
+            f.write('HELLO\n')
+        with open(bad, 'w', encoding='utf-8') as f:
+            f.write('PRICE: 5€\n')
+        manifest = self.out_path + 'manifest.txt'
+        with open(manifest, 'w') as f:
+            f.write(f'{bad}\n')
+
+        runner = CliRunner()
+        self.assertEqual(runner.invoke(app, ['utf2ata', '--check', good]).exit_code, 0)
+        for args in [[good, bad], [good, good, bad], ['--manifest', manifest, good]]:
+            result = runner.invoke(app, ['utf2ata', '--check', '--jobs', '1'] + args)
+            self.assertEqual(result.exit_code, 1, args)
+            self.assertIn(f'{bad}:1:9', result.output)
+        self.assertFalse(os.path.exists(bad + '.atascii'))